@@ -0,0 +1,166 @@
+"""Measure a chat client's CPU time per received message at a steady rate.
+
+A server and the sending clients run in their own processes, so only the
+receiving ChatTerminal is measured. Its output is discarded. Run from the
+repository root:
+
+    python -m benchmarks.client_receive_benchmark
+"""
+
+import contextlib
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from client.chat_client import ChatClient
+from client.chat_terminal import ChatTerminal
+
+# Messages per second sent to the receiving client
+RATE = 10_000
+
+# Seconds to send messages for in each run
+DURATION = 5
+
+# Clients sending the messages, taking turns
+SENDERS = 20
+
+# Messages sent at once, spread evenly over each second
+BATCH = 50
+
+# Node name the benchmark server runs as
+NODE = "benchmark"
+
+# A typical chat message
+MSG = "x" * 64
+
+
+def _free_port() -> int:
+    """Pick a port nothing is listening on."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _send(read_port: int, write_port: int, count: int) -> None:
+    """Broadcast messages at RATE from SENDERS clients."""
+    clients = [
+        ChatClient(f"sender{i}", "127.0.0.1", read_port, write_port, NODE)
+        for i in range(SENDERS)
+    ]
+    for client in clients:
+        client.start()
+
+    batch = [(MSG, None)] * BATCH
+    next_send = time.perf_counter()
+    for i in range(count // BATCH):
+        clients[i % SENDERS].send_batch(batch)
+        next_send += BATCH / RATE
+        time.sleep(max(next_send - time.perf_counter(), 0))
+
+    for client in clients:
+        client.exit()
+
+
+def _run(
+        terminal: ChatTerminal,
+        received: list[int],
+        read_port: int,
+        write_port: int
+) -> tuple[int, float]:
+    """Send messages to the terminal, measuring its CPU time.
+
+    Returns the number of broadcasts received and the CPU seconds used.
+    """
+    count = RATE * DURATION
+    received[0] = 0
+    sender = multiprocessing.Process(
+        target=_send, args=(read_port, write_port, count)
+    )
+
+    start_cpu = time.process_time()
+    sender.start()
+    sender.join()
+
+    # Let the last messages arrive
+    deadline = time.monotonic() + 5
+    while received[0] < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return received[0], time.process_time() - start_cpu
+
+
+def main() -> None:
+    """Run the benchmark and print the CPU time per message."""
+    read_port, write_port = _free_port(), _free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable, "server_start_script.py",
+            "--read-port", str(read_port),
+            "--write-port", str(write_port),
+            "--node", NODE
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL
+    )
+
+    # Wait for the server to start listening
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", read_port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    # Count broadcasts as they're received, alongside the terminal
+    received = [0]
+    count_lock = threading.Lock()
+
+    def count_msg(msg) -> None:
+        if msg.type == "BROADCAST":
+            with count_lock:
+                received[0] += 1
+
+    print(
+        f"{RATE} msgs/sec for {DURATION}s from {SENDERS} senders\n"
+        f"{'messages':<12}{'received':>10}{'CPU us/msg':>12}{'CPU %':>8}"
+    )
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            terminal = ChatTerminal(
+                "127.0.0.1", read_port, write_port, NODE, "receiver"
+            )
+            terminal.client.on_receive_message(count_msg)
+            terminal.client.start()
+
+        # Messages are displayed as they arrive, or queued while the user is
+        # typing and only formatted once displayed
+        for name, queued in (("displayed", False), ("queued", True)):
+            with contextlib.redirect_stdout(devnull):
+                if queued:
+                    terminal._enable_message_queue()
+                msgs, cpu = _run(terminal, received, read_port, write_port)
+                terminal._disable_message_queue()
+                terminal.msg_queue.clear()
+
+            print(
+                f"{name:<12}{msgs:>10}{cpu / max(msgs, 1) * 1e6:>12.2f}"
+                f"{cpu / DURATION * 100:>8.1f}"
+            )
+
+        with contextlib.redirect_stdout(devnull):
+            terminal.client.exit()
+
+    # Drain the server so it cleans up its socket files
+    if os.name == "nt":
+        server.terminate()
+    else:
+        server.send_signal(signal.SIGINT)
+    server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare loopback TCP and Unix domain sockets for framed messages.
+
+Run from the repository root:
+
+    python -m benchmarks.transport_benchmark
+"""
+
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+from shared.framed_server_socket import FramedServerSocket
+from shared.framed_socket import FramedSocket
+
+# Number of round trips timed for latency
+LATENCY_ROUNDS = 5_000
+
+# Number of messages sent one way for throughput
+THROUGHPUT_MSGS = 100_000
+
+# A typical chat message
+MSG = (
+    '{"type": "BROADCAST", "sender": "benchmark", "message": "'
+    + "x" * 64 + '"}'
+)
+
+
+def _echo(conn: FramedSocket) -> None:
+    """Send every received message straight back."""
+    def echo_msg(msg: str) -> bool:
+        conn.send_msg(msg)
+        return True
+    conn.receive_msg_forever(echo_msg)
+
+
+def _count(conn: FramedSocket, done: threading.Event) -> None:
+    """Count received messages, signalling once all have arrived."""
+    received = 0
+    def count_msg(msg: str) -> bool:
+        nonlocal received
+        received += 1
+        if received == THROUGHPUT_MSGS:
+            done.set()
+        return True
+    conn.receive_msg_forever(count_msg)
+
+
+def _bench_latency(addr: tuple[str, int] | str, family: int) -> list[float]:
+    """Time round trips to an echo server in microseconds."""
+    server = FramedServerSocket(addr, family=family)
+    server.start_server(conn_handler=_echo)
+
+    client = FramedSocket(family=family)
+    client.connect(addr)
+
+    round_trips = []
+    for _ in range(LATENCY_ROUNDS):
+        start = time.perf_counter()
+        client.send_msg(MSG)
+        client.recv_msg()
+        round_trips.append((time.perf_counter() - start) * 1_000_000)
+
+    client.close()
+    server.close_server()
+    return round_trips
+
+
+def _bench_throughput(addr: tuple[str, int] | str, family: int) -> float:
+    """Measure how many messages per second one client can send."""
+    done = threading.Event()
+    server = FramedServerSocket(addr, family=family)
+    server.start_server(conn_handler=lambda conn: _count(conn, done))
+
+    client = FramedSocket(family=family)
+    client.connect(addr)
+
+    start = time.perf_counter()
+    for _ in range(THROUGHPUT_MSGS):
+        client.send_msg(MSG)
+    done.wait()
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    server.close_server()
+    return THROUGHPUT_MSGS / elapsed
+
+
+def main() -> None:
+    """Run the benchmarks and print a comparison."""
+    transports = [("TCP loopback", ("127.0.0.1", 0), socket.AF_INET)]
+    if hasattr(socket, "AF_UNIX"):
+        path = os.path.join(tempfile.mkdtemp(), "benchmark.sock")
+        transports.append(("Unix socket", path, socket.AF_UNIX))
+
+    print(
+        f"{'transport':<14}{'median RTT (us)':>17}{'p99 RTT (us)':>14}"
+        f"{'msgs/sec':>12}"
+    )
+    for name, addr, family in transports:
+        # Pick a free port for each run so TIME_WAIT can't interfere
+        if family == socket.AF_INET:
+            with socket.socket() as probe:
+                probe.bind(addr)
+                addr = probe.getsockname()
+
+        round_trips = sorted(_bench_latency(addr, family))
+        median = statistics.median(round_trips)
+        p99 = round_trips[int(len(round_trips) * 0.99)]
+        msgs_per_sec = _bench_throughput(addr, family)
+        print(f"{name:<14}{median:>17.1f}{p99:>14.1f}{msgs_per_sec:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
 """A client for a chatroom."""
 
 import json
+import socket
 import threading
+import time
 from typing import Callable
 
-from config import HOST, WRITE_PORT, READ_PORT
+from config import (
+    HOST, WRITE_PORT, READ_PORT, RECONNECT_DELAY, RECONNECT_ATTEMPTS,
+    CLIENT_USE_UNIX_SOCKETS, UNIX_WRITE_PATH, UNIX_READ_PATH, NODE_NAME,
+    CLIENT_USE_MULTICAST, MULTICAST_HISTORY, MULTICAST_JOIN_TIMEOUT
+)
+from client.chat_message import ChatMessage
 from shared.framed_socket import FramedSocket
+from shared.multicast_socket import MulticastReceiver
 
 
 class ChatClient:
@@ -15,26 +23,55 @@ class ChatClient:
         """Message that should only be sent by the class was sent manually."""
         pass
 
-    def __init__(self, username: str) -> None:
-        """Initialize the chat client."""
+    def __init__(
+            self,
+            username: str,
+            host: str = HOST,
+            read_port: int = READ_PORT,
+            write_port: int = WRITE_PORT,
+            node_name: str = NODE_NAME
+    ) -> None:
+        """Initialize the chat client.
+
+        The node name picks the server's Unix domain sockets, when enabled.
+        """
         self.username = username
+        self._host = host
+        self._read_port = read_port
+        self._write_port = write_port
+        self._node_name = node_name
 
-        # Sends messages to the server
-        self._send_sock = FramedSocket()
+        # Connect to the server
+        self._connect()
 
-        # Connect the send sock to the server
-        # READ_PORT because we send to where the server receives
-        self._send_sock.connect((HOST, READ_PORT))
+        # Callbacks for when a message is received
+        self._recv_msg_listeners = []
 
-        # Receives messages from the server
-        self._recv_sock = FramedSocket()
+        # Callbacks for when the server can't be reconnected to
+        self._disconnect_listeners = []
 
-        # Connect the recv sock to the server
-        # WRITE_PORT because we recv from where the server sends
-        self._recv_sock.connect((HOST, WRITE_PORT))
+        # Whether the user has exited, the server has asked the client to
+        # reconnect, and the current connection is to a replacement server
+        self._exited = False
+        self._asked_to_reconnect = False
+        self._reconnected = False
 
-        # Callbacks for when a message is received
-        self._recv_msg_listeners = []
+        # Attempts left to reach a replacement server
+        self._reconnect_attempts = 0
+
+        # Receives broadcasts from the server's multicast group, if joined
+        self._multicast: MulticastReceiver | None = None
+
+        # Whether frames from the group have reached this client, and the
+        # broadcasts received over TCP while waiting to find out
+        self._multicast_confirmed = False
+        self._unconfirmed_broadcasts: list[ChatMessage] = []
+
+        # Sequence number of the next multicast frame, and earlier frames
+        # that were lost and asked for again
+        self._next_seq = 0
+        self._missing_seqs: set[int] = set()
+        self._multicast_lock = threading.Lock()
 
     def start(self) -> None:
         """Join the chatroom."""
@@ -42,25 +79,38 @@ class ChatClient:
         self._send_start()
 
         # Start receiving messages from the server
-        recv_thread = threading.Thread(
-            target=self._recv_sock.receive_msg_forever,
-            args=(self._receive_msg,)
-        )
+        recv_thread = threading.Thread(target=self._receive_forever)
         recv_thread.start()
 
     def exit(self):
         """Handle exiting the chatroom."""
+        self._exited = True
+
         # Send exit to the server
         self._send_exit()
 
         # Close sockets
         self._send_sock.close()
         self._recv_sock.close()
+        self._leave_multicast()
+
+    def on_receive_message(
+            self, listener: Callable[[ChatMessage], None]
+    ) -> None:
+        """Add a listener for receiving messages.
 
-    def on_receive_message(self, listener: Callable[[str], None]) -> None:
-        """Add a listener for receiving messages."""
+        Messages are passed undecoded, so listeners only pay for decoding the
+        fields they use.
+        """
         self._recv_msg_listeners.append(listener)
 
+    def on_disconnect(self, listener: Callable[[], None]) -> None:
+        """Add a listener for when the client gives up reconnecting.
+
+        Messages sent afterwards go nowhere, so the listener should exit.
+        """
+        self._disconnect_listeners.append(listener)
+
     def send_broadcast(self, msg: str) -> None:
         """Send a broadcast message to all recipients."""
         self._send_msg(
@@ -80,11 +130,295 @@ class ChatClient:
             message=msg,
         )
 
+    def send_batch(self, msgs: list[tuple[str, str | None]]) -> None:
+        """Send several messages at once.
+
+        Each message is given as (message, recipient), where a recipient of
+        None broadcasts the message.
+        """
+        batch = []
+        for msg, recipient in msgs:
+            msg_dict = {
+                "type": "PRIVATE" if recipient else "BROADCAST",
+                "sender": self.username
+            }
+            if recipient:
+                msg_dict["recipient"] = recipient
+            msg_dict["message"] = msg
+            batch.append(json.dumps(msg_dict))
+
+        self._send_sock.send_msgs(batch)
+
+    def send_search(self, query: str, page: int = 1) -> None:
+        """Search earlier messages, receiving one page of results."""
+        self._send_sock.send_msg(json.dumps({
+            "type": "SEARCH",
+            "sender": self.username,
+            "query": query,
+            "page": page
+        }))
+
+    def _connect(self) -> None:
+        """Open the sockets to the server."""
+        # Clients on the server's host can use Unix domain sockets
+        if CLIENT_USE_UNIX_SOCKETS:
+            family = socket.AF_UNIX
+            send_addr = UNIX_READ_PATH.format(node=self._node_name)
+            recv_addr = UNIX_WRITE_PATH.format(node=self._node_name)
+        else:
+            family = socket.AF_INET
+            send_addr = (self._host, self._read_port)
+            recv_addr = (self._host, self._write_port)
+
+        # Sends messages to the server
+        self._send_sock = FramedSocket(family=family)
+
+        # Connect the send sock to the server
+        # READ because we send to where the server receives
+        self._send_sock.connect(send_addr)
+
+        # Receives messages from the server
+        self._recv_sock = FramedSocket(family=family)
+
+        # Connect the recv sock to the server
+        # WRITE because we recv from where the server sends
+        self._recv_sock.connect(recv_addr)
+
+    def _receive_forever(self) -> None:
+        """Receive messages, then reconnect if the server went away."""
+        self._recv_sock.receive_msg_forever(self._receive_msg)
+        if self._exited:
+            return
+
+        # Server is closing, so reconnect to its replacement
+        if self._asked_to_reconnect:
+            self._asked_to_reconnect = False
+            self._reconnect_attempts = RECONNECT_ATTEMPTS
+            self._reconnect()
+        # A replacement server may drop the connection while it starts up
+        elif self._reconnected:
+            self._reconnect()
+
+    def _reconnect(self) -> None:
+        """Rejoin the chatroom once the server is back up.
+
+        Attempts are shared by every reconnect since the server asked, so a
+        replacement that keeps dropping the connection is given up on.
+        """
+        self._send_sock.close()
+        self._recv_sock.close()
+
+        # The next server offers its own multicast group, if any
+        self._leave_multicast()
+
+        while self._reconnect_attempts:
+            self._reconnect_attempts -= 1
+            time.sleep(RECONNECT_DELAY)
+            if self._exited:
+                return
+
+            try:
+                self._connect()
+            # Server isn't back up yet
+            except OSError:
+                self._send_sock.close()
+                continue
+
+            self._reconnected = True
+            self.start()
+            return
+
+        # Let the interface know the chatroom can't be reached
+        for listener in self._disconnect_listeners:
+            listener()
+
     def _receive_msg(self, msg: str) -> bool:
         """Call receive message listeners when receiving a message."""
+        chat_msg = ChatMessage(msg)
+        match chat_msg.type:
+            # Multicast messages are handled by the client alone
+            case "MULTICAST":
+                self._join_multicast(chat_msg.fields)
+                return True
+            case "RETRANSMITTED":
+                self._receive_retransmitted(chat_msg.fields)
+                return True
+            # Broadcasts arrive through the multicast group once it's joined
+            case "BROADCAST" if self._multicast:
+                if self._hold_tcp_broadcast(chat_msg):
+                    return True
+
+        self._call_listeners(chat_msg)
+
+        # Server is closing, so stop reading and reconnect to its replacement
+        if chat_msg.type == "RECONNECT":
+            self._asked_to_reconnect = True
+            return False
+
+        return True
+
+    def _call_listeners(self, msg: ChatMessage) -> None:
+        """Pass a received message to the receive message listeners."""
         for callback in self._recv_msg_listeners:
             callback(msg)
-        return True
+
+    def _hold_tcp_broadcast(self, msg: ChatMessage) -> bool:
+        """Check if a broadcast received over TCP should be held back.
+
+        Once the multicast group is joined, broadcasts arrive through it
+        instead. Until frames from it arrive, broadcasts are kept in case
+        none ever do.
+        """
+        with self._multicast_lock:
+            if not self._multicast:
+                return False
+            if not self._multicast_confirmed:
+                self._unconfirmed_broadcasts.append(msg)
+            return True
+
+    def _join_multicast(self, msg_dict: dict) -> None:
+        """Join the multicast group offered by the server.
+
+        The server is only told once frames from the group arrive. If the
+        group can't be joined, or no frames arrive in time, broadcasts keep
+        arriving over TCP.
+        """
+        addr = (msg_dict["group"], msg_dict["port"])
+
+        # Frames are numbered from the offer on
+        with self._multicast_lock:
+            self._next_seq = msg_dict["seq"]
+            self._missing_seqs.clear()
+
+        # Already in the group, such as when a replacement server takes over
+        if self._multicast and self._multicast.addr == addr:
+            if self._multicast_confirmed:
+                self._send_multicast_joined()
+            return
+
+        self._leave_multicast()
+        if not CLIENT_USE_MULTICAST:
+            return
+
+        try:
+            receiver = MulticastReceiver(addr)
+        # Multicast isn't routed to this client
+        except OSError:
+            return
+
+        with self._multicast_lock:
+            self._multicast = receiver
+            self._multicast_confirmed = False
+            self._unconfirmed_broadcasts = []
+
+        multicast_thread = threading.Thread(
+            target=receiver.receive_forever, args=(self._receive_multicast,)
+        )
+        multicast_thread.start()
+
+        # Joining only proves the group exists here, not that frames reach it
+        check_timer = threading.Timer(
+            MULTICAST_JOIN_TIMEOUT, self._check_multicast, args=(receiver,)
+        )
+        check_timer.daemon = True
+        check_timer.start()
+
+    def _send_multicast_joined(self) -> None:
+        """Tell the server to stop sending broadcasts over TCP."""
+        self._send_msg(
+            self._send_sock,
+            msg_type="MULTICAST_JOINED",
+            sender=self.username,
+        )
+
+    def _check_multicast(self, receiver: MulticastReceiver) -> None:
+        """Go back to receiving broadcasts over TCP if no frames arrived."""
+        with self._multicast_lock:
+            if self._multicast is not receiver or self._multicast_confirmed:
+                return
+            self._stop_multicast()
+        receiver.close()
+
+    def _leave_multicast(self) -> None:
+        """Leave the multicast group, if joined."""
+        with self._multicast_lock:
+            receiver = self._stop_multicast()
+        if receiver:
+            receiver.close()
+
+    def _stop_multicast(self) -> MulticastReceiver | None:
+        """Stop using the multicast group, returning its receiver to close.
+
+        Must be called holding the multicast lock.
+        """
+        receiver = self._multicast
+        self._multicast = None
+
+        # Broadcasts held back won't arrive through the group now. They're
+        # passed on while holding the lock so later ones wait their turn.
+        if not self._multicast_confirmed:
+            for msg in self._unconfirmed_broadcasts:
+                self._call_listeners(msg)
+        self._unconfirmed_broadcasts = []
+        self._multicast_confirmed = False
+        return receiver
+
+    def _receive_multicast(self, seq: int, msg: str) -> None:
+        """Handle a multicast frame, asking for any lost frames again."""
+        lost = []
+        confirmed = False
+        with self._multicast_lock:
+            # The first frame shows the group reaches this client. Broadcasts
+            # held back since the offer arrive through it or are asked for.
+            if not self._multicast_confirmed:
+                self._multicast_confirmed = True
+                self._unconfirmed_broadcasts = []
+                confirmed = True
+
+            if seq >= self._next_seq:
+                # Frames without a message announce a frame already sent
+                end = seq + 1 if not msg else seq
+                lost = list(range(
+                    max(self._next_seq, end - MULTICAST_HISTORY), end
+                ))
+                self._next_seq = seq + 1
+
+                # Forget lost frames too old for the server to still have
+                if lost:
+                    oldest = self._next_seq - MULTICAST_HISTORY
+                    self._missing_seqs = {
+                        missing_seq for missing_seq in self._missing_seqs
+                        if missing_seq >= oldest
+                    }
+                    self._missing_seqs.update(lost)
+                deliver = bool(msg)
+            # A lost frame arrived late, or a duplicate did. Frames without
+            # a message only announce it, so it's still missing.
+            elif msg:
+                deliver = seq in self._missing_seqs
+                self._missing_seqs.discard(seq)
+            else:
+                deliver = False
+
+        if confirmed:
+            self._send_multicast_joined()
+        if lost:
+            self._send_sock.send_msg(json.dumps({
+                "type": "RETRANSMIT",
+                "sender": self.username,
+                "seqs": lost
+            }))
+        if deliver:
+            self._call_listeners(ChatMessage(msg))
+
+    def _receive_retransmitted(self, msg_dict: dict) -> None:
+        """Handle a lost multicast frame sent again over TCP."""
+        with self._multicast_lock:
+            if msg_dict["seq"] not in self._missing_seqs:
+                return
+            self._missing_seqs.discard(msg_dict["seq"])
+
+        self._call_listeners(ChatMessage(msg_dict["frame"]))
 
     def _send_start(self) -> None:
         """Send a start message to the server."""
@@ -0,0 +1,89 @@
+"""Defines ChatMessage, a received message decoded only as needed."""
+
+import json
+import re
+
+# Messages sent by ChatClient start with their type and sender, neither of
+# which needs decoding unless it contains a quote or backslash
+_HEAD_PATTERN = re.compile(r'\{"type": "([A-Z_]+)", "sender": "([^"\\]*)"')
+
+# And end with their text
+_MESSAGE_START = '"message": "'
+_END = '"}'
+
+
+class ChatMessage:
+    """A received message that decodes its fields lazily.
+
+    Most messages are laid out the way ChatClient sends them, so their type,
+    sender and message are sliced straight out of the raw JSON. Anything
+    else, such as text with escaped characters, falls back to decoding the
+    whole message, which is then kept for other fields.
+    """
+
+    __slots__ = ("raw", "_type", "_sender", "_message", "_fields")
+
+    def __init__(self, raw: str) -> None:
+        """Initialize the message without decoding any of it."""
+        self.raw = raw
+        self._type: str | None = None
+        self._sender: str | None = None
+        self._message: str | None = None
+        self._fields: dict | None = None
+
+    @property
+    def type(self) -> str:
+        """The message's type, in upper case."""
+        if self._type is None:
+            self._decode_head()
+        return self._type
+
+    @property
+    def sender(self) -> str:
+        """The username of the message's sender."""
+        if self._sender is None:
+            self._decode_head()
+        return self._sender
+
+    @property
+    def message(self) -> str:
+        """The text of the message."""
+        if self._message is None:
+            self._decode_message()
+        return self._message
+
+    @property
+    def fields(self) -> dict:
+        """Every field of the message, decoded."""
+        if self._fields is None:
+            self._fields = json.loads(self.raw)
+        return self._fields
+
+    def __getitem__(self, key: str):
+        """Get a field of the message."""
+        return self.fields[key]
+
+    def _decode_head(self) -> None:
+        """Find the message's type and sender."""
+        head = _HEAD_PATTERN.match(self.raw)
+        if head:
+            self._type, self._sender = head.groups()
+            return
+
+        self._type = self.fields["type"].upper()
+        self._sender = self.fields["sender"]
+
+    def _decode_message(self) -> None:
+        """Find the message's text."""
+        raw = self.raw
+        start = raw.rfind(_MESSAGE_START)
+        if start != -1 and raw.endswith(_END):
+            message = raw[start + len(_MESSAGE_START):-len(_END)]
+
+            # Any quote or backslash in the text would have been escaped, so
+            # without them it's the whole text, needing no decoding
+            if '"' not in message and "\\" not in message:
+                self._message = message
+                return
+
+        self._message = self.fields["message"]
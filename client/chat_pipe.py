@@ -0,0 +1,164 @@
+"""Define ChatPipe, a non-interactive interface for a ChatClient."""
+
+import json
+import os
+import sys
+import threading
+from typing import BinaryIO
+
+from client.chat_client import ChatClient
+from client.chat_message import ChatMessage
+from config import (
+    HOST, READ_PORT, WRITE_PORT, NODE_NAME, ENCODING, PIPE_READ_BYTES,
+    PIPE_WRITE_BUFFER, PIPE_FLUSH_INTERVAL
+)
+
+
+class ChatPipe:
+    """Streams messages between stdin/stdout and the chatroom.
+
+    Each line of stdin is sent as a message. Lines starting with @example are
+    sent privately to the user 'example', the same as in ChatTerminal.
+    Whatever has arrived on stdin by each read is sent as one batch. Received
+    messages are written to stdout as newline-delimited JSON, buffered so
+    that busy rooms don't cost a write per message.
+    """
+
+    def __init__(
+            self,
+            username: str,
+            host: str = HOST,
+            read_port: int = READ_PORT,
+            write_port: int = WRITE_PORT,
+            node_name: str = NODE_NAME,
+            stdin: BinaryIO = None,
+            stdout: BinaryIO = None
+    ) -> None:
+        """Initialize the ChatPipe, connecting to the given server."""
+        self._stdin = stdin or sys.stdin.buffer
+        self._stdout = stdout or sys.stdout.buffer
+
+        # Received messages waiting to be written to stdout
+        self._out_buffer = bytearray()
+        self._out_lock = threading.Lock()
+
+        # Keeps buffered messages in order while they're written
+        self._write_lock = threading.Lock()
+
+        # Indicates that the pipe is closing
+        self._closed = threading.Event()
+
+        # Initialize chat client and listen for messages
+        self.client = ChatClient(
+            username, host, read_port, write_port, node_name
+        )
+        self.client.on_receive_message(self._receive_message)
+        self.client.on_disconnect(self._lose_server)
+
+    def start(self) -> None:
+        """Send stdin to the chatroom until it ends, then exit."""
+        # Connect to the chatroom
+        self.client.start()
+
+        # Write out buffered messages even when few are arriving
+        flush_thread = threading.Thread(
+            target=self._flush_forever, daemon=True
+        )
+        flush_thread.start()
+
+        try:
+            self._send_msgs_forever()
+        except KeyboardInterrupt:
+            pass
+        self.exit()
+
+    def exit(self) -> None:
+        """Exit the chatroom, writing out any buffered messages."""
+        self.client.exit()
+        self._closed.set()
+        self._flush()
+
+    def _lose_server(self) -> None:
+        """Write out buffered messages and exit once the server is gone.
+
+        Reading stdin can't be interrupted portably, so the process exits
+        with status 1 instead of waiting for stdin to end.
+        """
+        self._closed.set()
+        self._flush()
+        print("ERROR: Couldn't reconnect to the server", file=sys.stderr)
+        sys.stderr.flush()
+        os._exit(1)
+
+    def _send_msgs_forever(self) -> None:
+        """Send lines from stdin until it ends."""
+        partial_line = b""
+        while chunk := self._stdin.read1(PIPE_READ_BYTES):
+            lines = (partial_line + chunk).split(b"\n")
+
+            # The last line may not have fully arrived yet
+            partial_line = lines.pop()
+            self._send_lines(lines)
+
+        # Send the last line if stdin didn't end with a newline
+        self._send_lines([partial_line])
+
+    def _send_lines(self, lines: list[bytes]) -> None:
+        """Send lines from stdin as one batch, skipping invalid lines."""
+        msgs = []
+        for line in lines:
+            msg = line.decode(ENCODING, errors="replace").strip()
+            if not msg:
+                continue
+
+            # Broadcast message
+            if msg[0] != "@":
+                msgs.append((msg, None))
+                continue
+
+            # Private message, which needs both a recipient and a message
+            recipient, _, send_msg = msg[1:].partition(" ")
+            send_msg = send_msg.strip()
+            if not recipient or not send_msg:
+                print(
+                    "ERROR: Skipped a private message without both a"
+                    f" recipient and a message: {msg}",
+                    file=sys.stderr
+                )
+                continue
+            msgs.append((send_msg, recipient))
+
+        if msgs:
+            self.client.send_batch(msgs)
+
+    def _receive_message(self, msg: ChatMessage) -> None:
+        """Buffer a received message to be written to stdout."""
+        # Each message must fit on one line, which messages sent by
+        # ChatClient always do
+        raw_response = msg.raw
+        if "\n" in raw_response:
+            raw_response = json.dumps(json.loads(raw_response))
+
+        with self._out_lock:
+            self._out_buffer += raw_response.encode(ENCODING)
+            self._out_buffer += b"\n"
+            full = len(self._out_buffer) >= PIPE_WRITE_BUFFER
+
+        if full:
+            self._flush()
+
+    def _flush_forever(self) -> None:
+        """Write out buffered messages periodically until closed."""
+        while not self._closed.wait(PIPE_FLUSH_INTERVAL):
+            self._flush()
+
+    def _flush(self) -> None:
+        """Write buffered messages to stdout."""
+        with self._write_lock:
+            with self._out_lock:
+                data = self._out_buffer
+                self._out_buffer = bytearray()
+
+            if data:
+                self._stdout.write(data)
+                self._stdout.flush()
@@ -1,31 +1,57 @@
 """Define ChatTerminal, a textual interface for a ChatClient."""
 
-import json
+import time
 
 from client.chat_client import ChatClient
+from client.chat_message import ChatMessage
 from client.terminal import Terminal, TerminalColor
+from config import HOST, READ_PORT, WRITE_PORT, NODE_NAME, FORMAT_CACHE_SIZE
+
+# Stands in for the text of a message while formatting the text around it
+_PLACEHOLDER = "\0"
 
 
 class ChatTerminal:
     """UI for the chatroom."""
 
-    def __init__(self):
-        """Initialize the ChatTerminal."""
+    def __init__(
+            self,
+            host: str = HOST,
+            read_port: int = READ_PORT,
+            write_port: int = WRITE_PORT,
+            node_name: str = NODE_NAME,
+            username: str = None
+    ) -> None:
+        """Initialize the ChatTerminal, connecting to the given server.
+
+        The user is asked for their username unless one is given.
+        """
         # Interface for interacting with the terminal
         self.terminal = Terminal(self.exit)
 
         # Ask the user for their username
-        username = self._ask_username()
+        if not username:
+            username = self._ask_username()
 
         # Initialize chat client and listen for messages
-        self.client = ChatClient(username)
+        self.client = ChatClient(
+            username, host, read_port, write_port, node_name
+        )
         self.client.on_receive_message(self._receive_message)
+        self.client.on_disconnect(self._lose_server)
+
+        # Indicates that the server can no longer be reached
+        self._server_lost = False
 
         # Python doesn't support complex terminal manipulation on
         # Windows (at least not easily). Therefore, when the user is writing a
         # message, received messages must wait in a message queue before
-        # they're displayed to the user.
-        self.msg_queue = []
+        # they're displayed to the user. They're only formatted once they're
+        # displayed.
+        self.msg_queue: list[ChatMessage] = []
+
+        # Text around messages, formatted once per (type, sender)
+        self._format_cache: dict[tuple[str, str], tuple[str, str]] = dict()
 
         # Keeps track of when input is active so messages can be queued
         self._should_queue_messages = False
@@ -58,6 +84,8 @@ class ChatTerminal:
             " user with the username 'example'.\n"
             "Private messages to you are indicated with the separator '->' and"
             " the color purple.\n"
+            "Send /search followed by some words to find earlier messages."
+            " Add --page 2 to the end to see more results.\n"
             "Send !exit to leave the chatroom.\n"
         )
 
@@ -68,6 +96,8 @@ class ChatTerminal:
             # Wait till the user presses enter
             self.terminal.wait_for_enter()
             self.terminal.clear_previous_line()
+            if self._server_lost:
+                self.exit()
 
             # Prompt for message
             msg = self._prompt_for_msg()
@@ -75,6 +105,10 @@ class ChatTerminal:
             # Print messages in queue
             self._print_msg_queue()
 
+            # Nothing can be sent once the server is gone
+            if self._server_lost:
+                self.exit()
+
             # Parse message
             sending = self._parse_user_msg(msg)
 
@@ -94,7 +128,7 @@ class ChatTerminal:
 
         # Print the queued messages
         for msg in self.msg_queue:
-            self.terminal.print_line(msg)
+            self.terminal.print_line(self._parse_received_message(msg))
 
         # Clear the queued messages
         self.msg_queue.clear()
@@ -116,6 +150,11 @@ class ChatTerminal:
             self.exit()
             return False
 
+        # Validate & parse search
+        if msg.split()[0] == "/search":
+            self._parse_user_search(msg)
+            return True
+
         # Validate & parse private message
         if msg[0] == "@":
             self._parse_user_private_msg(msg)
@@ -169,33 +208,92 @@ class ChatTerminal:
         self.terminal.clear_line()
         self.terminal.print_line(private_msg)
 
-    def _receive_message(self, raw_response: str) -> None:
-        """Print or queue a received message."""
-        msg = self._parse_received_message(raw_response)
+    def _parse_user_search(self, msg: str) -> None:
+        """Parse user search and handle it.
+
+        If the search is invalid, display error message."""
+        words = msg.split()[1:]
+
+        # Get the page of results to show, if given
+        page = 1
+        if len(words) >= 2 and words[-2] == "--page":
+            if not words[-1].isdigit() or int(words[-1]) < 1:
+                self._print_error(
+                    "ERROR: The page must be a positive number. For example,"
+                    " '/search hello --page 2'."
+                )
+                return
+            page = int(words[-1])
+            words = words[:-2]
+
+        # No query is specified
+        if not words:
+            self._print_error(
+                "ERROR: You must specify what to search for. This means"
+                " /search must be followed by the words you want to find."
+                " For example, '/search hello'."
+            )
+            return
 
+        self.client.send_search(" ".join(words), page)
+
+    def _lose_server(self) -> None:
+        """Tell the user the server is gone and that they need to exit."""
+        self._server_lost = True
+        self._print_error(
+            "ERROR: Couldn't reconnect to the server. Press enter to exit."
+        )
+
+    def _receive_message(self, msg: ChatMessage) -> None:
+        """Print or queue a received message."""
         # Queue message if enabled
         if self._should_queue_messages:
             self.msg_queue.append(msg)
         # Print message
         else:
-            self.terminal.print_line(msg)
+            self.terminal.print_line(self._parse_received_message(msg))
 
-    def _parse_received_message(self, raw_response: str) -> str:
+    def _parse_received_message(self, msg: ChatMessage) -> str:
         """Parse and format a message for display."""
-        response = json.loads(raw_response)
-        sender = response["sender"]
+        match msg.type:
+            case "START" | "EXIT":
+                prefix, _ = self._cached_format(msg.type, msg.sender)
+                return prefix
+            case "BROADCAST" | "PRIVATE":
+                prefix, suffix = self._cached_format(msg.type, msg.sender)
+                return prefix + msg.message + suffix
+            case "RECONNECT":
+                return self._format_reconnect_message()
+            case "SEARCH_RESULTS":
+                return self._format_search_results(msg.fields)
+
+    def _cached_format(self, msg_type: str, sender: str) -> tuple[str, str]:
+        """Get the text that goes before and after a message's text."""
+        try:
+            return self._format_cache[(msg_type, sender)]
+        except KeyError:
+            pass
 
-        match response["type"].upper():
+        match msg_type:
             case "START":
-                return self._format_start_message(sender)
+                formatted = self._format_start_message(sender)
             case "EXIT":
-                return self._format_exit_message(sender)
+                formatted = self._format_exit_message(sender)
             case "BROADCAST":
-                msg = response["message"]
-                return self._format_broadcast_message(sender, msg)
-            case "PRIVATE":
-                msg = response["message"]
-                return self._format_private_message(sender, msg)
+                formatted = self._format_broadcast_message(
+                    sender, _PLACEHOLDER
+                )
+            case _:
+                formatted = self._format_private_message(
+                    sender, _PLACEHOLDER
+                )
+        prefix, _, suffix = formatted.partition(_PLACEHOLDER)
+
+        # Senders come and go, so start over rather than grow forever
+        if len(self._format_cache) >= FORMAT_CACHE_SIZE:
+            self._format_cache.clear()
+        self._format_cache[(msg_type, sender)] = (prefix, suffix)
+        return prefix, suffix
 
     def _format_start_message(self, sender: str) -> str:
         """Format a start message."""
@@ -209,6 +307,41 @@ class ChatTerminal:
             f"{sender} left the chat.", TerminalColor.Yellow
         )
 
+    def _format_reconnect_message(self) -> str:
+        """Format a reconnect message."""
+        return self.terminal.wrap_color(
+            "The server is restarting, reconnecting...", TerminalColor.Yellow
+        )
+
+    def _format_search_results(self, response: dict) -> str:
+        """Format a page of search results, one result per line."""
+        query = response["query"]
+        total = response["total"]
+        if not total:
+            return self.terminal.wrap_color(
+                f"No messages found for '{query}'.", TerminalColor.Green
+            )
+
+        lines = [self.terminal.wrap_color(
+            f"{total} messages found for '{query}'"
+            f" (page {response['page']} of {response['pages']}):",
+            TerminalColor.Green
+        )]
+        for result in response["results"]:
+            sent = time.strftime("%H:%M", time.localtime(result["time"]))
+            sender = result["sender"]
+            msg = result["message"]
+
+            # Show private results the way they were displayed
+            if result["type"] == "BROADCAST":
+                line = self._format_broadcast_message(sender, msg)
+            elif sender == self.client.username:
+                line = self._format_private_message(msg, result["recipient"])
+            else:
+                line = self._format_private_message(sender, msg)
+            lines.append(f"[{sent}] {line}")
+        return "\n".join(lines)
+
     def _format_broadcast_message(self, sender: str, msg: str) -> str:
         """Format a broadcast message."""
         return f"{sender} >> {msg}"
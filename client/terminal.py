@@ -1,6 +1,6 @@
 """Defines a Terminal class to assist with terminal interaction."""
 
-import os
+import shutil
 from enum import Enum
 from typing import Callable
 
@@ -30,7 +30,9 @@ class Terminal:
     ) -> None:
         """Initialize an interface for the terminal."""
         self._interrupt_handler = interrupt_handler
-        self._max_line_len = min(max_line_len, os.get_terminal_size().columns)
+        # Fall back to the max line length when not attached to a terminal
+        columns = shutil.get_terminal_size((max_line_len, 24)).columns
+        self._max_line_len = min(max_line_len, columns)
 
     def print_inline(self, msg: str, color: TerminalColor = None) -> None:
         """Print a message without a terminating newline."""
@@ -1,11 +1,52 @@
 """Start a chat client."""
 
+import argparse
+
+from client.chat_pipe import ChatPipe
 from client.chat_terminal import ChatTerminal
+from config import HOST, READ_PORT, WRITE_PORT, NODE_NAME
 
 
 def main():
     """Start a chat client."""
-    terminal = ChatTerminal()
+    parser = argparse.ArgumentParser(description="Start a chat client.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--read-port", type=int, default=READ_PORT)
+    parser.add_argument("--write-port", type=int, default=WRITE_PORT)
+    parser.add_argument(
+        "--node", default=NODE_NAME, help="name of the node to connect to"
+    )
+    parser.add_argument(
+        "--pipe",
+        action="store_true",
+        help="send lines from stdin and write received messages to stdout"
+        " as JSON, without prompting"
+    )
+    parser.add_argument(
+        "--username",
+        help="username to join with, asked for unless given (required with"
+        " --pipe)"
+    )
+    args = parser.parse_args()
+
+    # Usernames given up front must follow the same rules as typed ones
+    if args.username is not None and not args.username.isalnum():
+        parser.error("--username must be alphanumeric")
+
+    # Pipe mode can't prompt for a username
+    if args.pipe:
+        if not args.username:
+            parser.error("--pipe requires an alphanumeric --username")
+        pipe = ChatPipe(
+            args.username, args.host, args.read_port, args.write_port,
+            args.node
+        )
+        pipe.start()
+        return
+
+    terminal = ChatTerminal(
+        args.host, args.read_port, args.write_port, args.node, args.username
+    )
     terminal.start()
 
 
@@ -1,13 +1,119 @@
 """Configuration options for the chatroom."""
 
+import os
+import tempfile
+
 # Address/ports
 HOST = "localhost"
 READ_PORT = 15001
 WRITE_PORT = 15002
 
+# Federation
+# Name of this server node, which must be unique among its peers
+NODE_NAME = "main"
+# Port other server nodes link to (None to run a single server)
+PEER_PORT = None
+# Every other server node by name, as {"name": (host, peer port)}
+PEERS = {}
+# Seconds between attempts to link to a peer that isn't up
+PEER_RETRY_DELAY = 1
+# Messages kept for a peer whose link closed until it's reopened, such as
+# while the peer restarts
+MAX_QUEUED_RELAYS = 10000
+
+# Directory for the socket files below. It's absolute so that servers and
+# clients started from different directories find the same files.
+SOCKET_DIR = tempfile.gettempdir()
+
+# Unix domain sockets, which the server listens on alongside TCP so clients
+# on the same host can skip the TCP loopback stack (ignored on Windows)
+UNIX_SOCKETS = True
+# {node} is replaced with the node name
+UNIX_READ_PATH = os.path.join(SOCKET_DIR, "chatroom_{node}_read.sock")
+UNIX_WRITE_PATH = os.path.join(SOCKET_DIR, "chatroom_{node}_write.sock")
+# Whether clients connect over the Unix domain sockets instead of TCP
+CLIENT_USE_UNIX_SOCKETS = False
+
+# Multicast, which sends each broadcast once to every client on the LAN
+# instead of once per client over TCP
+# Group and port the server sends broadcasts to, as (group, port), or None
+# to send them over TCP only
+MULTICAST_ADDR = None
+# Address of the network interface to send and join groups on
+# ("0.0.0.0" lets the OS choose, "127.0.0.1" keeps traffic on this host)
+MULTICAST_INTERFACE = "0.0.0.0"
+# How many routers multicast frames may cross
+MULTICAST_TTL = 1
+# Broadcasts kept by the server to retransmit to clients that missed them
+MULTICAST_HISTORY = 4096
+# Largest message sent by multicast, larger ones are fetched over TCP
+MULTICAST_MAX_DATAGRAM = 8192
+# Seconds between frames announcing the latest sequence number, so clients
+# notice lost frames even when the room goes quiet
+MULTICAST_HEARTBEAT = 1
+# Whether clients join the server's multicast group when offered
+CLIENT_USE_MULTICAST = True
+# Seconds a client waits for a frame from the group before going back to
+# receiving broadcasts over TCP, longer than MULTICAST_HEARTBEAT
+MULTICAST_JOIN_TIMEOUT = 3
+
 # Sockets, data framing
 FRAME_BYTES = 4
 ENCODING = 'UTF-8'
 
+# Outbound scheduling
+# Messages sent to a client per round for control (START, EXIT, RECONNECT),
+# private and broadcast messages. More urgent messages are sent first each
+# round, and the weights keep broadcasts from being starved.
+PRIORITY_WEIGHTS = (8, 4, 1)
+# Most broadcasts queued for a client before it's disconnected for falling
+# too far behind
+MAX_QUEUED_BROADCASTS = 100000
+# Seconds to wait for queued messages to be sent before closing
+FLUSH_TIMEOUT = 5
+
+# Restarts
+# A new server takes over the sockets of a running server through this path
+# {node} is replaced with the node name
+HANDOFF_PATH = os.path.join(SOCKET_DIR, "chatroom_{node}_handoff.sock")
+# Name used as the sender of messages that come from the server itself
+SERVER_NAME = "SERVER"
+# Seconds between reconnect attempts after the server asks clients to
+# reconnect, and how many attempts to make before giving up
+RECONNECT_DELAY = 1
+RECONNECT_ATTEMPTS = 10
+
+# Search
+# Directory to save the message search index in (None to keep it in memory)
+# {node} is replaced with the node name, e.g. "search_index_{node}"
+SEARCH_INDEX_DIR = None
+# Messages per index segment, and how many segments to keep before
+# compacting them down to the newest messages
+SEARCH_SEGMENT_SIZE = 1000
+SEARCH_MAX_SEGMENTS = 8
+SEARCH_MAX_MESSAGES = 10000
+# Messages waiting to be indexed before new ones are left out of the index
+SEARCH_MAX_QUEUED = 10000
+# Results per page of search results
+SEARCH_PAGE_SIZE = 10
+
+# Pipe mode
+# Most bytes of stdin read at once, each read being sent as one batch
+PIPE_READ_BYTES = 65536
+# Bytes of received messages buffered before writing them to stdout, and the
+# longest they're held before being written anyway
+PIPE_WRITE_BUFFER = 65536
+PIPE_FLUSH_INTERVAL = 0.1
+
+# Profiling
+# Where the server's profiling admin commands save results by default
+PROFILE_TIMING_PATH = "server_timing.json"
+PROFILE_CPROFILE_PATH = "server_profile.pstats"
+PROFILE_SAMPLES_PATH = "server_samples.collapsed"
+# Seconds between stack samples
+PROFILE_SAMPLE_INTERVAL = 0.005
+
 # Terminal
 MAX_LINE_LENGTH = 99
+# Most (type, sender) pairs to keep formatted text for
+FORMAT_CACHE_SIZE = 1024
@@ -1,44 +1,330 @@
 """A server for a chatroom."""
 
 import json
+import os
+import socket
+import sys
+import threading
+import time
+from functools import partial
+from typing import Callable
 
-from config import HOST, WRITE_PORT, READ_PORT
+from config import (
+    HOST, WRITE_PORT, READ_PORT, HANDOFF_PATH, SERVER_NAME, UNIX_SOCKETS,
+    UNIX_WRITE_PATH, UNIX_READ_PATH, NODE_NAME, PEER_PORT, PEERS,
+    PROFILE_TIMING_PATH, PROFILE_CPROFILE_PATH, PROFILE_SAMPLES_PATH,
+    PROFILE_SAMPLE_INTERVAL, FLUSH_TIMEOUT, SEARCH_PAGE_SIZE, MULTICAST_ADDR,
+    SEARCH_INDEX_DIR, ENCODING
+)
+from server.federation import Federation
+from server.search_index import SearchIndex
 from shared.framed_server_socket import FramedServerSocket
 from shared.framed_socket import FramedSocket
+from shared.multicast_socket import MulticastSender
+from shared.priority_sender import Priority, PrioritySender
+from shared.profiling import PROFILER
+
+# Passing sockets between processes needs Unix domain sockets and SCM_RIGHTS
+HANDOFF_SUPPORTED = hasattr(socket, "send_fds")
+
+# Unix domain sockets aren't available on every platform
+UNIX_SOCKETS_SUPPORTED = hasattr(socket, "AF_UNIX")
 
 
 class ChatServer:
     """Chatroom server."""
 
-    def __init__(self) -> None:
-        """Initialize the chat server."""
-        # Sends messages to the connected clients
-        self.write_sock = FramedServerSocket((HOST, WRITE_PORT))
+    def __init__(
+            self,
+            host: str = HOST,
+            read_port: int = READ_PORT,
+            write_port: int = WRITE_PORT,
+            node_name: str = NODE_NAME,
+            peer_port: int | None = PEER_PORT,
+            peers: dict[str, tuple[str, int]] = PEERS,
+            multicast_addr: tuple[str, int] | None = MULTICAST_ADDR
+    ) -> None:
+        """Initialize the chat server.
+
+        If another server is running as the same node, its listening sockets
+        and client connections are taken over so clients don't have to
+        reconnect. Set peer_port to link with other server nodes, and
+        multicast_addr to send broadcasts to a multicast group.
+        """
+        self.host = host
+        self.read_port = read_port
+        self.write_port = write_port
+        self.node_name = node_name
+
+        # Each node on a host needs its own socket files and search index
+        self._handoff_path = HANDOFF_PATH.format(node=node_name)
+        self._unix_write_path = UNIX_WRITE_PATH.format(node=node_name)
+        self._unix_read_path = UNIX_READ_PATH.format(node=node_name)
+        self._search_index_dir = (
+            SEARCH_INDEX_DIR.format(node=node_name)
+            if SEARCH_INDEX_DIR else None
+        )
+
+        # Stores users and the senders for their connection sockets
+        self.users: dict[str, PrioritySender] = dict()
+
+        # Links to other server nodes, if enabled
+        self.federation: Federation | None = None
+
+        # Connections taken over from a previous server, handled on start
+        self._inherited_write_conns: list[tuple[str, FramedSocket]] = []
+        self._inherited_read_conns: list[FramedSocket] = []
+
+        # Receives handoff requests from replacement server processes
+        self._handoff_sock: FramedServerSocket | None = None
+
+        # Set while handing the sockets off to a replacement server
+        self._handing_off = False
+
+        # Set once the server has stopped serving clients
+        self._stopped = threading.Event()
+
+        # Listen for clients on the same host, if enabled
+        self.unix_write_sock: FramedServerSocket | None = None
+        self.unix_read_sock: FramedServerSocket | None = None
+
+        # Users receiving broadcasts by multicast instead of over TCP
+        self._multicast_users: set[str] = set()
+
+        # Sequence number to continue multicasting from after a handoff
+        self._multicast_seq = 1
 
-        # Reads messages from the connected clients
-        self.read_sock = FramedServerSocket((HOST, READ_PORT))
+        if not self._receive_handoff(peers):
+            # Sends messages to the connected clients
+            self.write_sock = FramedServerSocket((host, write_port))
 
-        # Stores users and their connection sockets
-        self.users: dict[str, FramedSocket] = dict()
+            # Reads messages from the connected clients
+            self.read_sock = FramedServerSocket((host, read_port))
+
+        # The federation may have been taken over from the previous server
+        if peer_port is not None and not self.federation:
+            self.federation = Federation(
+                node_name,
+                (host, peer_port),
+                peers,
+                deliver=self._handle_relayed_msg,
+                local_users=self._usernames
+            )
+
+        # Created after any handoff so the previous server's saved index is
+        # picked up
+        self.search_index = SearchIndex(self._search_index_dir)
+
+        # Sends broadcasts to a multicast group, if enabled
+        self.multicast: MulticastSender | None = None
+        if multicast_addr:
+            self.multicast = MulticastSender(
+                multicast_addr, self._multicast_seq
+            )
+
+        # Unix domain sockets may not have been taken over from the previous
+        # server if it had them disabled
+        if (
+                UNIX_SOCKETS
+                and UNIX_SOCKETS_SUPPORTED
+                and not self.unix_write_sock
+        ):
+            self.unix_write_sock = FramedServerSocket(
+                self._unix_write_path, family=socket.AF_UNIX
+            )
+            self.unix_read_sock = FramedServerSocket(
+                self._unix_read_path, family=socket.AF_UNIX
+            )
 
     def start(self) -> None:
         """Start the chat server."""
         print("Press CTRL+C at any time to close the server.")
+        print("Type help to list admin commands.")
 
         # Receive connections forever, storing them to send messages to later
-        self.write_sock.start_server(conn_handler=self._handle_write_conn)
+        for write_sock in self._write_socks():
+            write_sock.start_server(conn_handler=self._handle_write_conn)
 
         # Receive connections forever, reading messages from them
-        self.read_sock.start_server(conn_handler=self._handle_read_conn)
+        for read_sock in self._read_socks():
+            read_sock.start_server(conn_handler=self._handle_read_conn)
+
+        # Resume handling connections taken over from a previous server.
+        # Users are added before linking with peers so that messages peers
+        # queued for them during the handoff reach them.
+        for username, conn in self._inherited_write_conns:
+            self.write_sock.adopt_connection(
+                partial(self._add_user, username), conn, wait=True
+            )
+        for conn in self._inherited_read_conns:
+            self.read_sock.adopt_connection(self._handle_read_conn, conn)
+
+        # Link with the other server nodes
+        if self.federation:
+            self.federation.start()
+
+        # Let a replacement server take over when it starts
+        self._open_handoff_sock()
 
-        # Wait until a keyboard interrupt then close
+        # Run admin commands typed into the console. The thread can't be
+        # stopped while it waits for input, so it mustn't keep the process
+        # running.
+        command_thread = threading.Thread(
+            target=self._run_commands_forever, daemon=True
+        )
+        command_thread.start()
+
+        # Wait until the server is handed off or a keyboard interrupt
         try:
-            while True:
-                input()
+            while not self._stopped.wait(0.5):
+                pass
         except KeyboardInterrupt:
-            print("Server closing...")
-            self.write_sock.close_server()
-            self.read_sock.close_server()
+            print("Server draining...")
+            self.drain()
+
+    def drain(self) -> None:
+        """Close the server, asking clients to reconnect.
+
+        New connections are refused, clients' messages stop being read, and
+        clients are told to reconnect after every message already routed has
+        been sent.
+        """
+        self._close_handoff_sock()
+
+        # Stop taking new connections. The listening sockets are closed so
+        # clients reconnecting while the drain finishes are refused and try
+        # again, rather than getting stuck in a backlog nobody accepts from.
+        for server_sock in self._server_socks():
+            server_sock.stop_listening()
+
+        # Stop reading from clients, so that nothing is routed after they're
+        # asked to reconnect. Shutting down reading wakes idle connections
+        # right away, and anything clients haven't had read is dropped.
+        read_conns = [
+            read_conn
+            for read_sock in self._read_socks()
+            for read_conn in read_sock.connections()
+        ]
+        for read_conn in read_conns:
+            read_conn.stop_receiving(wait=False)
+            read_conn.shutdown(socket.SHUT_RD)
+        for read_conn in read_conns:
+            read_conn.stop_receiving()
+
+        # Ask all clients to reconnect to the next server, once they've been
+        # sent everything already queued for them since they stop reading
+        # when they're asked
+        self._forward_all(json.dumps({
+            "type": "RECONNECT",
+            "sender": SERVER_NAME
+        }), Priority.Control, after_queued=True)
+
+        # Give clients their queued messages before disconnecting them
+        self._stop_senders()
+
+        for server_sock in self._server_socks():
+            server_sock.close_server()
+        if self.federation:
+            self.federation.close()
+        if self.multicast:
+            self.multicast.close()
+        self.search_index.close()
+        self._stopped.set()
+
+    def _run_commands_forever(self) -> None:
+        """Run admin commands from the console until the server stops.
+
+        stdin is read directly rather than through sys.stdin, whose buffer
+        stays locked while it waits. Python aborts on exit if a daemon
+        thread holds that lock.
+        """
+        try:
+            stdin_fd = sys.stdin.fileno()
+        # No console to read commands from
+        except (AttributeError, OSError, ValueError):
+            return
+
+        partial_line = b""
+        while not self._stopped.is_set():
+            try:
+                chunk = os.read(stdin_fd, 4096)
+            except OSError:
+                return
+            # stdin ended
+            if not chunk:
+                return
+
+            # The last line may not have fully arrived yet
+            lines = (partial_line + chunk).split(b"\n")
+            partial_line = lines.pop()
+            for line in lines:
+                self._run_command(line.decode(ENCODING, errors="replace"))
+
+    def _run_command(self, command: str) -> None:
+        """Run an admin command."""
+        match command.split():
+            case []:
+                pass
+            case ["profile", "timing", "start"]:
+                PROFILER.start_timing()
+                print("Recording stage timings")
+            case ["profile", "timing", "stop", *path]:
+                path = path[0] if path else PROFILE_TIMING_PATH
+                self._save_profile(
+                    PROFILER.stop_timing, path, "stage timings",
+                    "Stage timings aren't being recorded"
+                )
+            case ["profile", "cprofile", "start"]:
+                PROFILER.start_cprofile()
+                print("Profiling stages with cProfile")
+            case ["profile", "cprofile", "stop", *path]:
+                path = path[0] if path else PROFILE_CPROFILE_PATH
+                self._save_profile(
+                    PROFILER.stop_cprofile, path, "profile",
+                    "cProfile isn't running"
+                )
+            case ["profile", "sample", "start"]:
+                PROFILER.start_sampling(PROFILE_SAMPLE_INTERVAL)
+                print("Sampling stacks")
+            case ["profile", "sample", "stop", *path]:
+                path = path[0] if path else PROFILE_SAMPLES_PATH
+                self._save_profile(
+                    PROFILER.stop_sampling, path, "stack samples",
+                    "Stacks aren't being sampled"
+                )
+            case _:
+                print(
+                    "Admin commands:\n"
+                    "  profile timing start|stop [path]"
+                    "   histograms of receive/decode/route/send times\n"
+                    "  profile cprofile start|stop [path]"
+                    " cProfile of those stages, in pstats format\n"
+                    "  profile sample start|stop [path]"
+                    "   stack samples, as collapsed stacks"
+                )
+
+    def _save_profile(
+            self,
+            stop: Callable[[str], bool],
+            path: str,
+            name: str,
+            not_running: str
+    ) -> None:
+        """Stop recording a profile and save it, reporting any error.
+
+        not_running is reported if nothing was being recorded.
+        """
+        try:
+            saved = stop(path)
+        # A bad path mustn't take down the console
+        except OSError as error:
+            print(f"ERROR: Couldn't save {name} to {path}: {error.strerror}")
+            return
+
+        if saved:
+            print(f"Saved {name} to {path}")
+        else:
+            print(f"ERROR: {not_running}")
 
     def _handle_write_conn(self, conn: FramedSocket) -> None:
         """Handle a connection from a client's receiving socket."""
@@ -47,7 +333,8 @@ class ChatServer:
         username = msg_dict["sender"]
 
         # Forward join msg to all clients (except the new user)
-        self._forward_all(msg)
+        self._forward_all(msg, Priority.Control)
+        self._relay_all(msg)
 
         # Add to dict of connected users
         self._add_user(username, conn)
@@ -58,51 +345,409 @@ class ChatServer:
         """Handle a connection from a client's sending socket."""
         # Receive messages from the client until they disconnect
         conn.receive_msg_forever(self._handle_read_msg)
-        conn.close()
+
+        # Leave the connection open for the replacement server
+        if not self._handing_off:
+            conn.close()
 
     def _handle_read_msg(self, msg: str) -> bool:
         """Handle a message sent from a client."""
-        msg_dict = json.loads(msg)
+        with PROFILER.stage("decode"):
+            msg_dict = json.loads(msg)
         msg_type = msg_dict["type"]
         username = msg_dict["sender"]
 
-        match msg_type.upper():
-            case "EXIT":
-                self._remove_user(username)
-                self._forward_all(msg)
-                print(f"Connection from {username} closed")
-
-                # Stop reading messages
-                return False
-            case "BROADCAST":
-                self._forward_all(msg)
-                print(f"Broadcast message from {username}")
-            case "PRIVATE":
-                recipient = msg_dict["recipient"]
-                self._forward_one(msg, recipient)
-                print(f"Private message from {username} to {recipient}")
+        with PROFILER.stage("route"):
+            match msg_type.upper():
+                case "EXIT":
+                    self._remove_user(username)
+                    self._forward_all(msg, Priority.Control, after_queued=True)
+                    self._relay_all(msg)
+                    print(f"Connection from {username} closed")
+
+                    # Stop reading messages
+                    return False
+                case "BROADCAST":
+                    self._broadcast(msg)
+                    self._relay_all(msg)
+                    self.search_index.add(msg_dict)
+                    print(f"Broadcast message from {username}")
+                case "PRIVATE":
+                    recipient = msg_dict["recipient"]
+                    if recipient in self.users:
+                        self._forward_one(msg, recipient, Priority.Private)
+                    elif self.federation:
+                        self.federation.relay_to_owner(msg, recipient)
+                    self.search_index.add(msg_dict)
+                    print(f"Private message from {username} to {recipient}")
+                case "SEARCH":
+                    self._handle_search(username, msg_dict)
+                    print(f"Search from {username}")
+                case "MULTICAST_JOINED":
+                    self._multicast_users.add(username)
+                    print(f"{username} joined the multicast group")
+                case "RETRANSMIT":
+                    self._retransmit(username, msg_dict.get("seqs"))
 
         # Continue reading messages so long as the server isn't closed
         return not self.read_sock.is_closed()
 
-    def _forward_all(self, msg: str) -> None:
-        """Forward a message to all clients."""
-        for conn in self.users.values():
-            conn.send_msg(msg)
+    def _handle_relayed_msg(self, msg: str, msg_dict: dict) -> None:
+        """Handle a message relayed from another server node."""
+        # Peers already relayed it to every node, so only deliver it here
+        with PROFILER.stage("route"):
+            match msg_dict["type"].upper():
+                case "START":
+                    self._forward_all(msg, Priority.Control)
+                case "EXIT":
+                    self._forward_all(msg, Priority.Control, after_queued=True)
+                case "BROADCAST":
+                    self._broadcast(msg)
+                    self.search_index.add(msg_dict)
+                case "PRIVATE":
+                    self._forward_one(
+                        msg, msg_dict["recipient"], Priority.Private
+                    )
+                    self.search_index.add(msg_dict)
+
+    def _handle_search(self, username: str, msg_dict: dict) -> None:
+        """Send a user one page of results for their search.
+
+        Searches without a text query and a positive whole page number are
+        ignored.
+        """
+        query = msg_dict.get("query")
+        page = msg_dict.get("page", 1)
+        if (
+                not isinstance(query, str)
+                or not isinstance(page, int)
+                or isinstance(page, bool)
+                or page < 1
+        ):
+            return
+
+        total, results = self.search_index.search(username, query, page)
+
+        self._forward_one(json.dumps({
+            "type": "SEARCH_RESULTS",
+            "sender": SERVER_NAME,
+            "query": query,
+            "page": page,
+            "pages": -(-total // SEARCH_PAGE_SIZE),
+            "total": total,
+            "results": results
+        }), username, Priority.Private)
+
+    def _retransmit(self, username: str, seqs: list[int]) -> None:
+        """Send a user the multicast broadcasts they missed.
+
+        Requests that aren't a list of sequence numbers are ignored.
+        """
+        if not self.multicast:
+            return
+        if not isinstance(seqs, list) or not all(
+                isinstance(seq, int) and not isinstance(seq, bool)
+                for seq in seqs
+        ):
+            return
+
+        for seq in seqs:
+            # Broadcasts that are no longer kept can't be sent again
+            msg = self.multicast.get(seq)
+            if msg is None:
+                continue
+
+            self._forward_one(json.dumps({
+                "type": "RETRANSMITTED",
+                "sender": SERVER_NAME,
+                "seq": seq,
+                "frame": msg
+            }), username, Priority.Private)
+
+    def _relay_all(self, msg: str) -> None:
+        """Relay a message to the other server nodes."""
+        if self.federation:
+            self.federation.relay_all(msg)
+
+    def _forward_all(
+            self, msg: str, priority: Priority, after_queued: bool = False
+    ) -> None:
+        """Forward a message to all clients.
+
+        If after_queued is True, it's sent after everything already queued.
+        """
+        for sender in list(self.users.values()):
+            sender.send_msg(msg, priority, after_queued)
 
-    def _forward_one(self, msg: str, recipient: str) -> None:
+    def _broadcast(self, msg: str) -> None:
+        """Send a broadcast message to all clients.
+
+        With multicast enabled, it's sent once to the multicast group and
+        only sent over TCP to users who haven't joined the group.
+        """
+        if not self.multicast:
+            self._forward_all(msg, Priority.Broadcast)
+            return
+
+        self.multicast.send(msg)
+        for username, sender in list(self.users.items()):
+            if username not in self._multicast_users:
+                sender.send_msg(msg, Priority.Broadcast)
+
+    def _forward_one(
+            self, msg: str, recipient: str, priority: Priority
+    ) -> None:
         """Forward a message to one client."""
         try:
-            conn = self.users[recipient]
+            sender = self.users[recipient]
         except KeyError:
             return
-        conn.send_msg(msg)
+        sender.send_msg(msg, priority)
+
+    def _stop_senders(self) -> None:
+        """Stop every client's sender once its queued messages are sent.
+
+        Clients still being sent messages after FLUSH_TIMEOUT are
+        disconnected, so one that stopped reading can't hold up the server.
+        """
+        deadline = time.monotonic() + FLUSH_TIMEOUT
+        for sender in list(self.users.values()):
+            sender.flush(max(deadline - time.monotonic(), 0))
+            sender.stop(max(deadline - time.monotonic(), 0))
+
+    def _usernames(self) -> list[str]:
+        """Get the usernames of the users connected to this node."""
+        return list(self.users)
 
     def _add_user(self, username: str, conn: FramedSocket) -> None:
         """Add a user."""
-        self.users[username] = conn
+        sender = PrioritySender(
+            conn, on_disconnect=partial(self._drop_user, username)
+        )
+
+        # Offer the multicast group before any broadcast is sent to the user,
+        # so every broadcast they're sent from then on is in the group
+        if self.multicast:
+            group, port = self.multicast.addr
+            sender.send_msg(json.dumps({
+                "type": "MULTICAST",
+                "sender": SERVER_NAME,
+                "group": group,
+                "port": port,
+                "seq": self.multicast.next_seq
+            }), Priority.Control)
+
+        self.users[username] = sender
 
     def _remove_user(self, username: str) -> None:
         """Remove a user."""
-        self.users[username].close()
-        self.users.pop(username)
+        sender = self.users.pop(username, None)
+        if sender:
+            sender.close()
+        self._multicast_users.discard(username)
+
+    def _drop_user(self, username: str, sender: PrioritySender) -> None:
+        """Remove a user whose connection was lost."""
+        # The user may have already reconnected with a new connection
+        if self.users.get(username) is sender:
+            self.users.pop(username, None)
+            self._multicast_users.discard(username)
+            print(f"Connection to {username} lost")
+        sender.close()
+
+    def _write_socks(self) -> list[FramedServerSocket]:
+        """Get the sockets that accept clients' receiving sockets."""
+        return [
+            write_sock
+            for write_sock in (self.write_sock, self.unix_write_sock)
+            if write_sock
+        ]
+
+    def _read_socks(self) -> list[FramedServerSocket]:
+        """Get the sockets that accept clients' sending sockets."""
+        return [
+            read_sock for read_sock in (self.read_sock, self.unix_read_sock)
+            if read_sock
+        ]
+
+    def _server_socks(self) -> list[FramedServerSocket]:
+        """Get all sockets that accept clients."""
+        return self._write_socks() + self._read_socks()
+
+    def _open_handoff_sock(self) -> None:
+        """Listen for a replacement server asking to take over."""
+        if not HANDOFF_SUPPORTED:
+            return
+
+        self._handoff_sock = FramedServerSocket(
+            self._handoff_path, family=socket.AF_UNIX
+        )
+        self._handoff_sock.start_server(
+            conn_handler=self._handle_handoff_conn
+        )
+
+    def _close_handoff_sock(self) -> None:
+        """Stop listening for replacement servers."""
+        if not self._handoff_sock:
+            return
+
+        self._handoff_sock.close_server()
+        self._handoff_sock = None
+
+    def _handle_handoff_conn(self, conn: FramedSocket) -> None:
+        """Hand the sockets off to a replacement server, then stop."""
+        print("Handing off to a new server...")
+        self._handing_off = True
+
+        # The replacement server accepts new connections from now on
+        for server_sock in self._server_socks():
+            server_sock.stop_accepting()
+
+        # Peers relink to the replacement server, once messages they already
+        # relayed here are delivered
+        if self.federation:
+            self.federation.stop_receiving(FLUSH_TIMEOUT)
+
+        # Only one process may read from a connection at a time
+        all_read_conns = [
+            read_conn
+            for read_sock in self._read_socks()
+            for read_conn in read_sock.connections()
+        ]
+        for read_conn in all_read_conns:
+            read_conn.stop_receiving(wait=False)
+        for read_conn in all_read_conns:
+            read_conn.stop_receiving()
+
+        # Only one process may write to a connection at a time
+        self._stop_senders()
+
+        users = [
+            (username, sender)
+            for username, sender in list(self.users.items())
+            if not sender.is_closed()
+        ]
+        read_conns = [
+            read_conn for read_conn in all_read_conns
+            if not read_conn.is_closed()
+        ]
+
+        # Save the search index for the replacement server to load
+        self.search_index.close()
+
+        # Multicast numbering carries on in the replacement server
+        multicast_seq = 1
+        if self.multicast:
+            self.multicast.close()
+            multicast_seq = self.multicast.next_seq
+
+        # Peers' new links wait on the listener for the replacement server
+        peer_sock_fds = []
+        directory = {}
+        if self.federation:
+            peer_sock_fds.append(self.federation.fileno())
+            directory = self.federation.directory
+
+        # Describe the sockets, then pass them in the same order
+        conn.send_msg(json.dumps({
+            "unix_socks": self.unix_write_sock is not None,
+            "peer_sock": self.federation is not None,
+            "directory": directory,
+            "users": [username for username, _ in users],
+            "read_conns": len(read_conns),
+            "multicast_seq": multicast_seq
+        }))
+        conn.send_fds(
+            [server_sock.fileno() for server_sock in self._server_socks()]
+            + peer_sock_fds
+            + [sender.fileno() for _, sender in users]
+            + [read_conn.fileno() for read_conn in read_conns]
+        )
+        conn.close()
+
+        # The replacement server owns the paths now, so don't unlink them
+        self._handoff_sock.release()
+        self._handoff_sock = None
+
+        # The replacement server holds its own copies of the sockets
+        for server_sock in self._server_socks():
+            server_sock.release()
+        if self.federation:
+            self.federation.release()
+
+        print(f"Handed off {len(users)} users to the new server")
+        self._stopped.set()
+
+    def _receive_handoff(self, peers: dict[str, tuple[str, int]]) -> bool:
+        """Take over the sockets of a running server.
+
+        Returns whether there was a running server to take over from.
+        """
+        if not HANDOFF_SUPPORTED or not os.path.exists(self._handoff_path):
+            return False
+
+        conn = FramedSocket(family=socket.AF_UNIX)
+        try:
+            conn.connect(self._handoff_path)
+        # Path was left by a server that didn't close cleanly
+        except OSError:
+            conn.close()
+            return False
+
+        handoff = json.loads(conn.recv_msg())
+        server_sock_count = (
+            (4 if handoff["unix_socks"] else 2) + handoff["peer_sock"]
+        )
+        usernames = handoff["users"]
+        self._multicast_seq = handoff.get("multicast_seq", 1)
+        fds = conn.recv_fds(
+            server_sock_count + len(usernames) + handoff["read_conns"]
+        )
+        conn.close()
+
+        server_sock_fds = fds[:server_sock_count]
+        user_fds = fds[server_sock_count:server_sock_count + len(usernames)]
+        read_conn_fds = fds[server_sock_count + len(usernames):]
+
+        # Listening sockets are passed in the order of _server_socks
+        server_socks = iter(
+            [socket.socket(fileno=fd) for fd in server_sock_fds]
+        )
+        self.write_sock = FramedServerSocket(
+            (self.host, self.write_port), next(server_socks), bound=True
+        )
+        if handoff["unix_socks"]:
+            self.unix_write_sock = FramedServerSocket(
+                self._unix_write_path, next(server_socks), bound=True
+            )
+        self.read_sock = FramedServerSocket(
+            (self.host, self.read_port), next(server_socks), bound=True
+        )
+        if handoff["unix_socks"]:
+            self.unix_read_sock = FramedServerSocket(
+                self._unix_read_path, next(server_socks), bound=True
+            )
+        if handoff["peer_sock"]:
+            peer_sock = next(server_socks)
+            self.federation = Federation(
+                self.node_name,
+                peer_sock.getsockname(),
+                peers,
+                deliver=self._handle_relayed_msg,
+                local_users=self._usernames,
+                sock=peer_sock
+            )
+            self.federation.directory.update(handoff["directory"])
+
+        for username, fd in zip(usernames, user_fds):
+            sock = socket.socket(fileno=fd)
+            sock.setblocking(True)
+            self._inherited_write_conns.append((username, FramedSocket(sock)))
+
+        for fd in read_conn_fds:
+            self._inherited_read_conns.append(
+                FramedSocket(socket.socket(fileno=fd))
+            )
+
+        print(f"Took over {len(usernames)} users from the previous server")
+        return True
@@ -0,0 +1,282 @@
+"""Defines Federation, which links chat server nodes together."""
+
+import json
+import socket
+import threading
+import time
+from functools import partial
+from typing import Callable
+
+from config import PEER_RETRY_DELAY, MAX_QUEUED_RELAYS
+from shared.framed_server_socket import FramedServerSocket
+from shared.framed_socket import FramedSocket
+from shared.profiling import PROFILER
+
+
+class Federation:
+    """Relays chat messages between a server node and its peer nodes.
+
+    Every node must list every other node as a peer. Each node opens a link
+    to each of its peers and only sends over the links it opened, the same way
+    clients use separate sockets to send and receive.
+    """
+
+    def __init__(
+            self,
+            node_name: str,
+            addr: tuple[str, int],
+            peers: dict[str, tuple[str, int]],
+            deliver: Callable[[str, dict], None],
+            local_users: Callable[[], list[str]],
+            sock: socket.socket = None
+    ) -> None:
+        """Initialize the federation.
+
+        Relayed messages are passed to deliver, along with their decoded
+        contents. local_users should return the users connected to this node.
+        If a listening socket is supplied, it must already be bound.
+        """
+        self.node_name = node_name
+        self._peers = peers
+        self._deliver = deliver
+        self._local_users = local_users
+
+        # Receives links from peers
+        self._server_sock = FramedServerSocket(
+            addr, sock, bound=sock is not None
+        )
+
+        # Links to peers, by node name
+        self._links: dict[str, FramedSocket] = dict()
+
+        # Messages for peers whose links closed, sent once they're reopened
+        self._queued: dict[str, list[str]] = dict()
+
+        # Keeps a new link's HELLO and queued messages ahead of anything
+        # else relayed over it
+        self._links_lock = threading.Lock()
+
+        # Wakes the linking thread when a link closes
+        self._relink = threading.Event()
+
+        # Stores which node each user on another node is connected to
+        self.directory: dict[str, str] = dict()
+
+        # The current link opened by each peer, by node name
+        self._peer_conns: dict[str, FramedSocket] = dict()
+
+        # Keeps a closing link from purging users a newer one introduced
+        self._peer_conns_lock = threading.Lock()
+
+        # Indicates that the federation is closing
+        self._closed = threading.Event()
+
+    def start(self) -> None:
+        """Start linking with peers."""
+        # Receive links from peers forever, reading messages from them
+        self._server_sock.start_server(conn_handler=self._handle_peer_conn)
+
+        # Keep links open to all peers
+        link_thread = threading.Thread(target=self._link_peers_forever)
+        link_thread.start()
+
+    def close(self) -> None:
+        """Close all links and stop receiving links."""
+        self._closed.set()
+        self._relink.set()
+        self._server_sock.close_server()
+        self._close_links()
+
+    def stop_receiving(self, timeout: float) -> None:
+        """Stop receiving links and ask peers to close theirs.
+
+        Peers relink right away, and their new links wait on the listener
+        until another process takes it over. Blocks until messages already
+        relayed over the old links have been delivered, or the timeout.
+        """
+        self._server_sock.stop_accepting()
+
+        # Peers close their end once they see this end is done sending
+        conns = self._server_sock.connections()
+        for conn in conns:
+            conn.shutdown(socket.SHUT_WR)
+
+        deadline = time.monotonic() + timeout
+        while (
+                any(not conn.is_closed() for conn in conns)
+                and time.monotonic() < deadline
+        ):
+            time.sleep(0.05)
+
+    def release(self) -> None:
+        """Close this process's handles without shutting down the listener.
+
+        Used once the listening socket has been handed off to another process.
+        Links from peers are shut down so that they notice right away.
+        """
+        self._closed.set()
+        self._relink.set()
+        for conn in self._server_sock.connections():
+            conn.shutdown()
+        self._server_sock.release()
+
+        # Links to peers are left to close when this process exits, after
+        # the replacement server has introduced its users to them. Shutting
+        # them down now would have peers forget those users in between.
+        with self._links_lock:
+            links = list(self._links.values())
+        for link in links:
+            link.close()
+
+    def fileno(self) -> int:
+        """Return the listening socket's file descriptor."""
+        return self._server_sock.fileno()
+
+    def relay_all(self, msg: str) -> None:
+        """Relay a message to every peer."""
+        with self._links_lock:
+            links = list(self._links.items())
+        for node_name, link in links:
+            self._send(node_name, link, msg)
+
+    def relay_to_owner(self, msg: str, recipient: str) -> None:
+        """Relay a message to the node that a user is connected to."""
+        try:
+            with self._links_lock:
+                node_name = self.directory[recipient]
+                link = self._links[node_name]
+        except KeyError:
+            return
+        self._send(node_name, link, msg)
+
+    def _send(self, node_name: str, link: FramedSocket, msg: str) -> None:
+        """Send a message over a link, queueing it if the link has closed.
+
+        A partly sent message is dropped by the peer, so it's sent again.
+        """
+        if not link.is_closed():
+            link.send_msg(msg)
+            if not link.is_closed():
+                return
+
+        with self._links_lock:
+            # The link was reopened meanwhile
+            current_link = self._links.get(node_name)
+            if current_link is not link:
+                if current_link:
+                    current_link.send_msg(msg)
+                return
+
+            # Drop the oldest messages rather than grow without bound
+            queued = self._queued.setdefault(node_name, [])
+            queued.append(msg)
+            if len(queued) > MAX_QUEUED_RELAYS:
+                del queued[:len(queued) - MAX_QUEUED_RELAYS]
+        self._relink.set()
+
+    def _close_links(self) -> None:
+        """Shut down and close the links this node opened."""
+        with self._links_lock:
+            links = list(self._links.values())
+        for link in links:
+            link.shutdown()
+            link.close()
+
+    def _link_peers_forever(self) -> None:
+        """Open links to peers, reopening any that close."""
+        while not self._closed.is_set():
+            self._relink.clear()
+            for node_name, addr in self._peers.items():
+                link = self._links.get(node_name)
+                if not link or link.is_closed():
+                    self._link_peer(node_name, addr)
+
+            self._relink.wait(PEER_RETRY_DELAY)
+
+    def _link_peer(self, node_name: str, addr: tuple[str, int]) -> None:
+        """Open a link to a peer and introduce this node to it."""
+        link = FramedSocket()
+        try:
+            link.connect(addr)
+        # Peer isn't up, so messages for it can't be delivered
+        except OSError:
+            link.close()
+            with self._links_lock:
+                self._links.pop(node_name, None)
+                self._queued.pop(node_name, None)
+            return
+
+        # Tell the peer which users are connected here. The link is added
+        # first so that users who connect meanwhile are relayed over it,
+        # but only once the HELLO and messages queued while the previous
+        # link was closed have been sent.
+        with self._links_lock:
+            self._links[node_name] = link
+            link.send_msg(json.dumps({
+                "type": "HELLO",
+                "sender": self.node_name,
+                "users": self._local_users()
+            }))
+            queued = self._queued.pop(node_name, None)
+            if queued:
+                link.send_msgs(queued)
+        print(f"Linked to peer {node_name}")
+
+        # Peers never send over this link, but reading from it notices when
+        # the peer closes it so it can be reopened right away
+        watch_thread = threading.Thread(
+            target=self._watch_link, args=(link,)
+        )
+        watch_thread.start()
+
+    def _watch_link(self, link: FramedSocket) -> None:
+        """Wait for a peer to close a link, then reopen it."""
+        link.receive_msg_forever(lambda msg: True)
+        link.close()
+        self._relink.set()
+
+    def _handle_peer_conn(self, conn: FramedSocket) -> None:
+        """Handle a link opened by a peer."""
+        hello = json.loads(conn.recv_msg())
+        node_name = hello["sender"]
+
+        # Replace what was known about the peer's users
+        with self._peer_conns_lock:
+            self._peer_conns[node_name] = conn
+            self._purge_directory(node_name)
+            for username in hello["users"]:
+                self.directory[username] = node_name
+
+        # Receive relayed messages until the peer disconnects
+        conn.receive_msg_forever(partial(self._handle_peer_msg, node_name))
+        conn.close()
+
+        # Forget the peer's users, unless it has already linked again
+        with self._peer_conns_lock:
+            if self._peer_conns.get(node_name) is conn:
+                self._peer_conns.pop(node_name)
+                self._purge_directory(node_name)
+
+    def _purge_directory(self, node_name: str) -> None:
+        """Remove the users connected to a node from the directory."""
+        for username, user_node in list(self.directory.items()):
+            if user_node == node_name:
+                self.directory.pop(username, None)
+
+    def _handle_peer_msg(self, node_name: str, msg: str) -> bool:
+        """Handle a message relayed from a peer."""
+        with PROFILER.stage("decode"):
+            msg_dict = json.loads(msg)
+        username = msg_dict["sender"]
+
+        # Track which node each user is connected to
+        match msg_dict["type"].upper():
+            case "START":
+                self.directory[username] = node_name
+            case "EXIT":
+                self.directory.pop(username, None)
+
+        self._deliver(msg, msg_dict)
+
+        # Continue reading messages so long as the federation isn't closed
+        return not self._closed.is_set()
@@ -0,0 +1,338 @@
+"""Defines SearchIndex, an inverted index for searching chat messages."""
+
+import json
+import math
+import os
+import queue
+import re
+import threading
+import time
+
+from config import (
+    SEARCH_INDEX_DIR, SEARCH_SEGMENT_SIZE, SEARCH_MAX_SEGMENTS,
+    SEARCH_MAX_MESSAGES, SEARCH_PAGE_SIZE, SEARCH_MAX_QUEUED
+)
+
+# Words are runs of letters and digits, matched case-insensitively
+_WORD_PATTERN = re.compile(r"\w+")
+
+# Segment files are named after the ids of the first and last messages
+_SEGMENT_FILE_PATTERN = re.compile(r"segment_(\d+)_(\d+)\.json")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase words."""
+    return _WORD_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    """An incremental inverted index over BROADCAST and PRIVATE messages.
+
+    Messages are queued by add() and indexed on a background thread so that
+    routing never waits on indexing. New messages go into an active segment.
+    Once full, it's sealed, and written to disk if an index directory is
+    configured, keeping only its postings in memory. When there are too many
+    sealed segments, they're compacted into one holding only the newest
+    messages, bounding the index's size.
+    """
+
+    class _Segment:
+        """A group of consecutive indexed messages."""
+
+        def __init__(
+                self,
+                first_id: int,
+                messages: dict[int, dict] = None,
+                path: str = None
+        ) -> None:
+            """Initialize the segment.
+
+            On-disk segments are given a path instead of their messages, and
+            only their postings are read from it.
+            """
+            self.first_id = first_id
+            self.last_id = first_id - 1
+
+            # Indexed messages by id, empty if stored on disk
+            self.messages: dict[int, dict] = dict()
+
+            # For each word, how often it appears in each message by id
+            self.postings: dict[str, dict[int, int]] = dict()
+
+            # Sender and recipient of each private message by id, so that
+            # visibility is checked without the messages themselves
+            self.private: dict[int, tuple[str, str]] = dict()
+
+            # File the segment is stored in, if it's on disk
+            self.path = path
+            if path:
+                filename = os.path.basename(path)
+                match = _SEGMENT_FILE_PATTERN.fullmatch(filename)
+                self.last_id = int(match.group(2))
+
+                with open(path) as file:
+                    saved = json.load(file)
+                self.postings = {
+                    word: {
+                        int(msg_id): count
+                        for msg_id, count in word_postings.items()
+                    }
+                    for word, word_postings in saved["postings"].items()
+                }
+                self.private = {
+                    int(msg_id): tuple(users)
+                    for msg_id, users in saved["private"].items()
+                }
+
+            for msg_id, msg in (messages or {}).items():
+                self.add(msg_id, msg)
+
+        def __len__(self) -> int:
+            """Get the number of messages in the segment."""
+            return self.last_id - self.first_id + 1
+
+        def add(self, msg_id: int, msg: dict) -> None:
+            """Add a message to the segment."""
+            self.messages[msg_id] = msg
+            self.last_id = msg_id
+            for word in tokenize(msg["message"]):
+                word_postings = self.postings.setdefault(word, dict())
+                word_postings[msg_id] = word_postings.get(msg_id, 0) + 1
+            if msg["type"] == "PRIVATE":
+                self.private[msg_id] = (msg["sender"], msg.get("recipient"))
+
+        def can_see(self, username: str, msg_id: int) -> bool:
+            """Check if a user may see one of the segment's messages."""
+            users = self.private.get(msg_id)
+            return users is None or username in users
+
+        def loaded(self) -> "SearchIndex._Segment":
+            """Get the segment with its messages in memory."""
+            if not self.path:
+                return self
+            return SearchIndex._Segment(
+                self.first_id, SearchIndex._Segment.read(self.path)
+            )
+
+        @staticmethod
+        def read(path: str) -> dict[int, dict]:
+            """Read the messages of a segment saved to disk."""
+            with open(path) as file:
+                messages = json.load(file)["messages"]
+            return {int(msg_id): msg for msg_id, msg in messages.items()}
+
+        def save(self, index_dir: str) -> None:
+            """Write the segment to disk and drop its messages from memory.
+
+            Its postings are written too, and kept in memory for searching.
+            """
+            self.path = os.path.join(
+                index_dir,
+                f"segment_{self.first_id:012d}_{self.last_id:012d}.json"
+            )
+            with open(self.path, "w") as file:
+                json.dump({
+                    "messages": self.messages,
+                    "postings": self.postings,
+                    "private": self.private
+                }, file)
+
+            self.messages = dict()
+
+    def __init__(self, index_dir: str | None = SEARCH_INDEX_DIR) -> None:
+        """Initialize the index, loading any segments saved on disk.
+
+        If index_dir is None, the index is only kept in memory.
+        """
+        self._index_dir = index_dir
+
+        # Sealed segments, oldest first
+        self._sealed: list[SearchIndex._Segment] = []
+
+        # Pick up where a previous server left off
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+            for filename in sorted(os.listdir(index_dir)):
+                match = _SEGMENT_FILE_PATTERN.fullmatch(filename)
+                if match:
+                    self._sealed.append(self._Segment(
+                        int(match.group(1)),
+                        path=os.path.join(index_dir, filename)
+                    ))
+
+        # Receives new messages
+        next_id = self._sealed[-1].last_id + 1 if self._sealed else 0
+        self._active = self._Segment(next_id)
+
+        # Guards the segments between the indexing and searching threads
+        self._lock = threading.Lock()
+
+        # Messages waiting to be indexed, ended by None
+        self._queue: queue.Queue[tuple[float, dict] | None] = queue.Queue(
+            SEARCH_MAX_QUEUED
+        )
+        self._index_thread = threading.Thread(target=self._index_forever)
+        self._index_thread.start()
+
+    def add(self, msg_dict: dict) -> None:
+        """Queue a BROADCAST or PRIVATE message to be indexed.
+
+        Malformed messages are skipped, and so are messages added while the
+        queue is full, so that the index's memory stays bounded.
+        """
+        fields = ("type", "sender", "message")
+        if not all(isinstance(msg_dict.get(field), str) for field in fields):
+            return
+        if not isinstance(msg_dict.get("recipient", ""), str):
+            return
+
+        try:
+            self._queue.put_nowait((time.time(), msg_dict))
+        # Indexing has fallen behind
+        except queue.Full:
+            pass
+
+    def search(
+            self, username: str, query: str, page: int = 1
+    ) -> tuple[int, list[dict]]:
+        """Search the messages a user may see.
+
+        Returns the total number of matches and one page of them, best first.
+        Messages score higher the more often they contain the query's words,
+        especially rare words. Ties go to newer messages.
+        """
+        words = set(tokenize(query))
+        if not words:
+            return 0, []
+
+        # Compaction may remove a segment's file before it's read, in which
+        # case the search is run again over the merged segment
+        while True:
+            # The indexing thread mustn't change segments while they're
+            # scored, but files are only read once the lock is released
+            with self._lock:
+                matches = self._match(username, words)
+
+            matches.sort(
+                key=lambda match: (match[0], match[1]), reverse=True
+            )
+            start = (page - 1) * SEARCH_PAGE_SIZE
+            page_matches = matches[start:start + SEARCH_PAGE_SIZE]
+            try:
+                return len(matches), self._read_results(page_matches)
+            except FileNotFoundError:
+                continue
+
+    def close(self) -> None:
+        """Finish indexing queued messages and save the index to disk."""
+        self._queue.put(None)
+        self._index_thread.join()
+
+        with self._lock:
+            if self._index_dir and len(self._active):
+                self._active.save(self._index_dir)
+
+    def _match(self, username: str, words: set[str]) -> list[tuple]:
+        """Score the messages a user may see that contain any of the words.
+
+        Returns (score, id, source) for each matching message. The source
+        is the message itself if it's in memory, or else the path of the
+        file it's saved in.
+        """
+        segments = self._sealed + [self._active]
+
+        # Rarer words count for more
+        msg_count = sum(len(segment) for segment in segments)
+        word_weights = dict()
+        for word in words:
+            doc_count = sum(
+                len(segment.postings.get(word, ())) for segment in segments
+            )
+            if doc_count:
+                word_weights[word] = math.log(1 + msg_count / doc_count)
+
+        # Score every visible message containing a word from the query
+        matches = []
+        for segment in segments:
+            scores = dict()
+            for word, weight in word_weights.items():
+                for msg_id, count in segment.postings.get(word, {}).items():
+                    score = weight * (1 + math.log(count))
+                    scores[msg_id] = scores.get(msg_id, 0) + score
+
+            for msg_id, score in scores.items():
+                if segment.can_see(username, msg_id):
+                    source = segment.path or segment.messages[msg_id]
+                    matches.append((score, msg_id, source))
+        return matches
+
+    def _read_results(self, matches: list[tuple]) -> list[dict]:
+        """Get the messages of scored matches, reading each file once.
+
+        Raises FileNotFoundError if a file was removed by compaction.
+        """
+        saved_messages = dict()
+        results = []
+        for _, msg_id, source in matches:
+            if isinstance(source, str):
+                if source not in saved_messages:
+                    saved_messages[source] = self._Segment.read(source)
+                source = saved_messages[source][msg_id]
+            results.append(source)
+        return results
+
+    def _index_forever(self) -> None:
+        """Index queued messages until closed."""
+        while (item := self._queue.get()) is not None:
+            received, msg_dict = item
+
+            # Store only what's needed to display a result
+            msg = {
+                "type": msg_dict["type"].upper(),
+                "sender": msg_dict["sender"],
+                "message": msg_dict["message"],
+                "time": received
+            }
+            if "recipient" in msg_dict:
+                msg["recipient"] = msg_dict["recipient"]
+
+            with self._lock:
+                self._active.add(self._active.last_id + 1, msg)
+                if len(self._active) >= SEARCH_SEGMENT_SIZE:
+                    self._seal()
+                if len(self._sealed) > SEARCH_MAX_SEGMENTS:
+                    self._compact()
+
+    def _seal(self) -> None:
+        """Seal the active segment and start a new one."""
+        if self._index_dir:
+            self._active.save(self._index_dir)
+        self._sealed.append(self._active)
+        self._active = self._Segment(self._active.last_id + 1)
+
+    def _compact(self) -> None:
+        """Merge the sealed segments, keeping only the newest messages."""
+        keep = max(SEARCH_MAX_MESSAGES - len(self._active), 0)
+        first_kept_id = self._active.first_id - keep
+
+        messages = dict()
+        for segment in self._sealed:
+            if segment.last_id < first_kept_id:
+                continue
+            for msg_id, msg in segment.loaded().messages.items():
+                if msg_id >= first_kept_id:
+                    messages[msg_id] = msg
+
+        old_segments = self._sealed
+        self._sealed = []
+        if messages:
+            merged = self._Segment(min(messages), messages)
+            if self._index_dir:
+                merged.save(self._index_dir)
+            self._sealed.append(merged)
+
+        # Remove the files of the merged segments
+        kept_paths = {segment.path for segment in self._sealed}
+        for segment in old_segments:
+            if segment.path and segment.path not in kept_paths:
+                os.remove(segment.path)
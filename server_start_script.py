@@ -1,11 +1,57 @@
 """Start a chat server."""
 
+import argparse
+
+from config import (
+    HOST, READ_PORT, WRITE_PORT, NODE_NAME, PEER_PORT, PEERS, MULTICAST_ADDR
+)
 from server.chat_server import ChatServer
 
 
+def parse_peer(peer: str) -> tuple[str, tuple[str, int]]:
+    """Parse a peer given as name=host:port."""
+    name, addr = peer.split("=", 1)
+    host, port = addr.rsplit(":", 1)
+    return name, (host, int(port))
+
+
+def parse_multicast(addr: str) -> tuple[str, int]:
+    """Parse a multicast address given as group:port."""
+    group, port = addr.rsplit(":", 1)
+    return group, int(port)
+
+
 def main():
     """Start a chat server."""
-    server = ChatServer()
+    parser = argparse.ArgumentParser(description="Start a chat server.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--read-port", type=int, default=READ_PORT)
+    parser.add_argument("--write-port", type=int, default=WRITE_PORT)
+    parser.add_argument("--node", default=NODE_NAME, help="name of this node")
+    parser.add_argument(
+        "--peer-port", type=int, default=PEER_PORT,
+        help="port other server nodes link to"
+    )
+    parser.add_argument(
+        "--peer", type=parse_peer, action="append", metavar="NAME=HOST:PORT",
+        help="another server node to link to, may be given more than once"
+    )
+    parser.add_argument(
+        "--multicast", type=parse_multicast, default=MULTICAST_ADDR,
+        metavar="GROUP:PORT",
+        help="multicast group to send broadcasts to, such as 239.255.0.1:15005"
+    )
+    args = parser.parse_args()
+
+    server = ChatServer(
+        args.host,
+        args.read_port,
+        args.write_port,
+        args.node,
+        args.peer_port,
+        dict(args.peer) if args.peer else PEERS,
+        args.multicast
+    )
     server.start()
 
 
@@ -1,5 +1,6 @@
 """Defines FramedServerSocket to receive connections from FramedSockets."""
 
+import os
 import socket
 import threading
 from typing import Callable
@@ -8,17 +9,37 @@ from shared.framed_socket import FramedSocket
 
 
 class FramedServerSocket:
-    """A multi-threaded TCP server utilizing framed sockets."""
+    """A multi-threaded TCP or Unix domain server utilizing framed sockets."""
 
     def __init__(
-            self, addr: tuple[str, int], sock: socket.socket = None
+            self,
+            addr: tuple[str, int] | str,
+            sock: socket.socket = None,
+            bound: bool = False,
+            family: int = socket.AF_INET
     ) -> None:
-        """Initialize the FramedServerSocket."""
-        self._sock = sock or socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        """Initialize the FramedServerSocket.
+
+        Pass bound=True with a socket that is already bound, such as a
+        listening socket inherited from another process. If no socket is
+        supplied, one is created with the given address family.
+        """
+        self._sock = sock or socket.socket(family, socket.SOCK_STREAM)
         self._addr = addr
 
         # Bind the socket to the specified address
-        self._sock.bind(self._addr)
+        if not bound:
+            # Replace the path left by a server that didn't close cleanly
+            if self._sock.family == getattr(socket, "AF_UNIX", None):
+                self._unlink()
+
+            # Allow restarting while old connections are in TIME_WAIT
+            # (Windows lets another socket steal the address instead)
+            if self._sock.family == socket.AF_INET and os.name != "nt":
+                self._sock.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+                )
+            self._sock.bind(self._addr)
 
         # Track client connections
         self._connections = set()
@@ -26,14 +47,74 @@ class FramedServerSocket:
         # Indicates that the server is closing
         self._closed = False
 
+        # Indicates that new connections should be accepted
+        self._accepting = True
+        self._recv_thread = None
+
     def start_server(
             self, conn_handler: Callable[[FramedSocket], None]
     ) -> None:
         """Start receiving connections, passing them to a handler."""
-        recv_thread = threading.Thread(
+        # Listen before returning so clients can connect right away
+        self._sock.listen()
+
+        self._recv_thread = threading.Thread(
             target=self._receive_conn_forever, args=(conn_handler,)
         )
-        recv_thread.start()
+        self._recv_thread.start()
+
+    def stop_accepting(self) -> None:
+        """Stop accepting new connections without closing the server.
+
+        Existing connections are left open. Blocks until the accepting thread
+        has exited.
+        """
+        self._accepting = False
+        if self._recv_thread:
+            self._recv_thread.join()
+
+    def stop_listening(self) -> None:
+        """Stop accepting and close the listening socket.
+
+        Existing connections are left open. Clients connecting afterwards are
+        refused right away instead of waiting in the listening socket's
+        backlog for a server that will never accept them.
+        """
+        self._accepting = False
+
+        # Necessary to close a socket while it's blocked
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+        # Remove the socket file so clients can't try to connect to it
+        if self._sock.family == getattr(socket, "AF_UNIX", None):
+            self._unlink()
+
+        if self._recv_thread:
+            self._recv_thread.join()
+
+    def adopt_connection(
+            self,
+            conn_handler: Callable[[FramedSocket], None],
+            conn: FramedSocket,
+            wait: bool = False
+    ) -> None:
+        """Handle a connection that was accepted elsewhere.
+
+        If wait is True, the handler runs on this thread, so it must return
+        promptly.
+        """
+        if wait:
+            self._handle_connection(conn_handler, conn)
+            return
+
+        conn_thread = threading.Thread(
+            target=self._handle_connection, args=(conn_handler, conn,)
+        )
+        conn_thread.start()
 
     def close_server(self) -> None:
         """Close the server."""
@@ -47,23 +128,58 @@ class FramedServerSocket:
 
         self._sock.close()
 
+        # Remove the socket file so clients can't try to connect to it
+        if self._sock.family == getattr(socket, "AF_UNIX", None):
+            self._unlink()
+
         # Close all connected sockets
         for conn in list(self._connections):
             conn.close()
 
+    def release(self) -> None:
+        """Close the server without shutting down its sockets.
+
+        Only this process's handles are closed, so sockets that were handed
+        off to another process stay open there.
+        """
+        self._closed = True
+        self.stop_accepting()
+        self._sock.close()
+
+        for conn in list(self._connections):
+            conn.close()
+
     def is_closed(self) -> bool:
         """Check if the server is closed."""
         return self._closed
 
+    def connections(self) -> list[FramedSocket]:
+        """Get the connections that are currently open."""
+        return list(self._connections)
+
+    def fileno(self) -> int:
+        """Return the listening socket's file descriptor."""
+        return self._sock.fileno()
+
+    def _unlink(self) -> None:
+        """Remove the file of a Unix domain socket."""
+        try:
+            os.unlink(self._addr)
+        except FileNotFoundError:
+            pass
+
     def _receive_conn_forever(
             self, handler: Callable[[FramedSocket], None]
     ) -> None:
         """Receive connections and pass them to a handler."""
-        self._sock.listen()
-        while not self._closed:
+        # Periodically check whether to stop accepting
+        self._sock.settimeout(1)
+        while self._accepting and not self._closed:
             # Receive connection
             try:
                 conn, addr = self._sock.accept()
+            except socket.timeout:
+                continue
             # Socket closed while accepting
             except OSError:
                 break
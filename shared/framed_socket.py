@@ -1,13 +1,21 @@
-"""Defines FramedSocket, a length prefixed TCP socket."""
+"""Defines FramedSocket, a length prefixed stream socket."""
 
 import socket
+import threading
 from typing import Callable
 
 from config import FRAME_BYTES, ENCODING
+from shared.profiling import PROFILER
+
+# Seconds between checks for whether to stop receiving
+RECV_TIMEOUT = 3
+
+# Linux refuses to pass more than 253 descriptors in one message
+MAX_FDS_PER_MSG = 250
 
 
 class FramedSocket:
-    """A length prefixed TCP socket."""
+    """A length prefixed stream socket, over TCP or a Unix domain socket."""
 
     class EndOfMessageError(EOFError):
         """Indicates the message ended before it was expected."""
@@ -17,16 +25,27 @@ class FramedSocket:
             self,
             sock: socket.socket = None,
             frame_bytes: int = FRAME_BYTES,
-            encoding: str = ENCODING
+            encoding: str = ENCODING,
+            family: int = socket.AF_INET
     ) -> None:
-        """Initialize the FramedSocket."""
-        self._sock = sock or socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        """Initialize the FramedSocket.
+
+        If no socket is supplied, one is created with the given address family.
+        """
+        self._sock = sock or socket.socket(family, socket.SOCK_STREAM)
         self._frame_bytes = frame_bytes
         self._encoding = encoding
 
         # Keeps track of whether the socket is closed
         self._closed = False
 
+        # Only one thread may send at a time so frames are never interleaved
+        self._send_lock = threading.Lock()
+
+        # Allows receive_msg_forever to be stopped without closing the socket
+        self._stop_receiving = threading.Event()
+        self._done_receiving = threading.Event()
+
     def receive_msg_forever(self, handler: Callable[[str], bool]) -> None:
         """Receive messages forever, passing them to a handler.
 
@@ -34,8 +53,12 @@ class FramedSocket:
         and True otherwise.
         """
         receiving = True
-        self._sock.settimeout(3)
-        while receiving and not self._closed:
+        self._sock.settimeout(RECV_TIMEOUT)
+        while (
+                receiving
+                and not self._closed
+                and not self._stop_receiving.is_set()
+        ):
             try:
                 # Receive message
                 msg = self.recv_msg()
@@ -50,6 +73,17 @@ class FramedSocket:
             # Keep receiving only if the handler says to
             receiving = handler(msg)
 
+        self._done_receiving.set()
+
+    def stop_receiving(self, wait: bool = True) -> None:
+        """Stop receive_msg_forever without closing the socket.
+
+        If wait is True, block until the receiving loop has exited.
+        """
+        self._stop_receiving.set()
+        if wait:
+            self._done_receiving.wait(RECV_TIMEOUT + 1)
+
     def recv_msg(self) -> str:
         """Receive an entire framed message."""
         # Get the expected length of the message
@@ -59,43 +93,119 @@ class FramedSocket:
         if not raw_msg_len:
             raise OSError("Socket disconnected from remote.")
 
-        # Decode the expected length of the message
-        msg_len = int.from_bytes(raw_msg_len, byteorder="big")
+        # Time from when a message starts arriving, not while waiting for one
+        with PROFILER.stage("receive"):
+            # The length may be split across multiple receives
+            raw_msg_len += self._recv_rest(
+                self._frame_bytes - len(raw_msg_len)
+            )
+
+            # Decode the expected length of the message
+            msg_len = int.from_bytes(raw_msg_len, byteorder="big")
+
+            # Receive until the expected length is reached
+            full_msg = self._recv_rest(msg_len)
 
-        # Receive until the expected length is reached
-        full_msg = b""
-        while len(full_msg) < msg_len:
-            recv_msg = self._sock.recv(msg_len - len(full_msg))
-            if not recv_msg:
+            # Decode and return the message
+            return full_msg.decode(self._encoding)
+
+    def _recv_rest(self, byte_count: int) -> bytes:
+        """Receive the rest of a message that has started arriving.
+
+        Timeouts are ignored so a message is never left partially received.
+        """
+        data = bytearray()
+        while len(data) < byte_count:
+            try:
+                recv_data = self._sock.recv(byte_count - len(data))
+            except socket.timeout:
+                continue
+            if not recv_data:
                 raise self.EndOfMessageError(
-                    f"Expected {msg_len} bytes but only received"
-                    f" {len(full_msg)} before the socket closed"
+                    f"Expected {byte_count} bytes but only received"
+                    f" {len(data)} before the socket closed"
                 )
-            full_msg += recv_msg
-
-        # Decode and return the message
-        return full_msg.decode(self._encoding)
+            data += recv_data
+        return bytes(data)
 
     def send_msg(self, msg: str):
         """Frame and send a message."""
-        # Encode the message
+        with PROFILER.stage("send"):
+            self._send_framed(self._frame(msg))
+
+    def send_msgs(self, msgs: list[str]) -> None:
+        """Frame and send several messages with a single write."""
+        with PROFILER.stage("send"):
+            self._send_framed(b"".join(self._frame(msg) for msg in msgs))
+
+    def _frame(self, msg: str) -> bytes:
+        """Encode a message and prefix it with its length."""
         encoded_msg = msg.encode(self._encoding)
+        msg_len = len(encoded_msg).to_bytes(
+            self._frame_bytes, byteorder="big"
+        )
+        return msg_len + encoded_msg
 
-        # Frame the message
-        msg_len = len(encoded_msg).to_bytes(self._frame_bytes, byteorder="big")
-        framed_msg = msg_len + encoded_msg
+    def _send_framed(self, data: bytes) -> None:
+        """Send framed messages."""
+        # Wait for any other thread's frame to finish sending
+        with PROFILER.stage("lock"):
+            self._send_lock.acquire()
 
         # Send the message
         try:
-            self._sock.sendall(framed_msg)
+            self._sock.sendall(data)
         # Socket is no longer connected
         except OSError:
             self.close()
+        finally:
+            self._send_lock.release()
 
-    def connect(self, addr: tuple[str, int]) -> None:
+    def connect(self, addr: tuple[str, int] | str) -> None:
         """Connect to the supplied address."""
         self._sock.connect(addr)
 
+    def send_fds(self, fds: list[int]) -> None:
+        """Pass file descriptors over a Unix domain socket."""
+        # The kernel limits how many descriptors fit in a single message
+        for i in range(0, len(fds), MAX_FDS_PER_MSG):
+            socket.send_fds(self._sock, [b"\0"], fds[i:i + MAX_FDS_PER_MSG])
+
+    def recv_fds(self, fd_count: int) -> list[int]:
+        """Receive file descriptors passed over a Unix domain socket."""
+        fds = []
+        while len(fds) < fd_count:
+            _, recv_fds, _, _ = socket.recv_fds(
+                self._sock, 1, min(fd_count - len(fds), MAX_FDS_PER_MSG)
+            )
+            if not recv_fds:
+                raise self.EndOfMessageError(
+                    f"Expected {fd_count} file descriptors but only received"
+                    f" {len(fds)} before the socket closed"
+                )
+            fds.extend(recv_fds)
+        return fds
+
+    def fileno(self) -> int:
+        """Return the socket's file descriptor."""
+        return self._sock.fileno()
+
+    def is_closed(self) -> bool:
+        """Check if the socket is closed."""
+        return self._closed
+
+    def shutdown(self, how: int = socket.SHUT_RDWR) -> None:
+        """Shut the connection down, interrupting any blocked send.
+
+        Pass how=socket.SHUT_WR to only tell the other end nothing more will
+        be sent.
+        """
+        try:
+            self._sock.shutdown(how)
+        # Already disconnected
+        except OSError:
+            pass
+
     def close(self) -> None:
         """Close the socket."""
         self._closed = True
@@ -0,0 +1,188 @@
+"""Defines MulticastSender and MulticastReceiver for UDP multicast frames.
+
+Each frame is one datagram: a sequence number followed by a message. A frame
+without a message only announces the latest sequence number.
+"""
+
+import os
+import socket
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from config import (
+    ENCODING, MULTICAST_INTERFACE, MULTICAST_TTL, MULTICAST_HISTORY,
+    MULTICAST_MAX_DATAGRAM, MULTICAST_HEARTBEAT
+)
+from shared.profiling import PROFILER
+
+# Size of the big-endian sequence number starting each frame
+SEQ_BYTES = 8
+
+# Largest datagram that can be received
+MAX_DATAGRAM = 65535
+
+# Seconds between checks for whether to stop receiving
+RECV_TIMEOUT = 3
+
+
+class MulticastSender:
+    """Sends numbered messages to a multicast group.
+
+    Recent messages are kept so that receivers which lost some frames can
+    have them sent another way. Messages too large to send as one datagram
+    are only kept, and announced so receivers fetch them right away.
+    """
+
+    def __init__(
+            self,
+            addr: tuple[str, int],
+            first_seq: int = 1,
+            interface: str = MULTICAST_INTERFACE,
+            ttl: int = MULTICAST_TTL
+    ) -> None:
+        """Initialize the sender and start announcing its sequence number.
+
+        Messages are numbered from first_seq, which must be at least 1 so
+        that there's an earlier number to announce before any are sent.
+        """
+        self.addr = addr
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl
+        )
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._sock.setsockopt(
+            socket.IPPROTO_IP,
+            socket.IP_MULTICAST_IF,
+            socket.inet_aton(interface)
+        )
+
+        # Sequence number of the next message
+        self.next_seq = first_seq
+
+        # Recently sent messages by sequence number, oldest first
+        self._history: OrderedDict[int, str] = OrderedDict()
+
+        # Keeps sequence numbers in the order frames are sent
+        self._lock = threading.Lock()
+
+        # Indicates that the sender is closing
+        self._closed = threading.Event()
+
+        heartbeat_thread = threading.Thread(target=self._heartbeat_forever)
+        heartbeat_thread.start()
+
+    def send(self, msg: str) -> None:
+        """Send a message to the group."""
+        with PROFILER.stage("send"):
+            encoded_msg = msg.encode(ENCODING)
+            with self._lock:
+                seq = self.next_seq
+                self.next_seq += 1
+                self._history[seq] = msg
+                if len(self._history) > MULTICAST_HISTORY:
+                    self._history.popitem(last=False)
+
+                # Receivers fetch large messages instead
+                if len(encoded_msg) > MULTICAST_MAX_DATAGRAM:
+                    encoded_msg = b""
+                self._send_frame(seq, encoded_msg)
+
+    def get(self, seq: int) -> str | None:
+        """Get a recently sent message, or None if it's no longer kept."""
+        with self._lock:
+            return self._history.get(seq)
+
+    def close(self) -> None:
+        """Stop sending."""
+        self._closed.set()
+        self._sock.close()
+
+    def _heartbeat_forever(self) -> None:
+        """Announce the latest sequence number periodically until closed.
+
+        Receivers also rely on these to know that frames reach them at all.
+        """
+        while not self._closed.wait(MULTICAST_HEARTBEAT):
+            with self._lock:
+                if not self._closed.is_set():
+                    self._send_frame(self.next_seq - 1, b"")
+
+    def _send_frame(self, seq: int, encoded_msg: bytes) -> None:
+        """Send a frame, dropping it if the network refuses it."""
+        try:
+            self._sock.sendto(
+                seq.to_bytes(SEQ_BYTES, byteorder="big") + encoded_msg,
+                self.addr
+            )
+        # Receivers recover lost frames, so carry on
+        except OSError:
+            pass
+
+
+class MulticastReceiver:
+    """Receives numbered messages sent to a multicast group."""
+
+    def __init__(
+            self,
+            addr: tuple[str, int],
+            interface: str = MULTICAST_INTERFACE
+    ) -> None:
+        """Join the group.
+
+        Raises OSError if the group can't be joined.
+        """
+        self.addr = addr
+        group, port = addr
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Let every client on this host receive the group
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                self._sock.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_REUSEPORT, 1
+                )
+
+            # Binding to the group filters out other traffic to the port
+            # (Windows can only bind to a local address)
+            self._sock.bind(("" if os.name == "nt" else group, port))
+            self._sock.setsockopt(
+                socket.IPPROTO_IP,
+                socket.IP_ADD_MEMBERSHIP,
+                socket.inet_aton(group) + socket.inet_aton(interface)
+            )
+        except OSError:
+            self._sock.close()
+            raise
+
+        # Keeps track of whether the socket is closed
+        self._closed = False
+
+    def receive_forever(self, handler: Callable[[int, str], None]) -> None:
+        """Receive frames until closed, passing them to a handler.
+
+        The handler takes the sequence number and message as input. The
+        message is empty for frames that only announce a sequence number.
+        """
+        self._sock.settimeout(RECV_TIMEOUT)
+        while not self._closed:
+            try:
+                frame = self._sock.recv(MAX_DATAGRAM)
+            # Periodically check if the socket is closed
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            # Ignore anything too short to be a frame
+            if len(frame) < SEQ_BYTES:
+                continue
+
+            seq = int.from_bytes(frame[:SEQ_BYTES], byteorder="big")
+            handler(seq, frame[SEQ_BYTES:].decode(ENCODING))
+
+    def close(self) -> None:
+        """Leave the group."""
+        self._closed = True
+        self._sock.close()
@@ -0,0 +1,197 @@
+"""Defines PrioritySender, which schedules outbound messages by priority."""
+
+import threading
+from collections import deque
+from enum import Enum
+from typing import Callable
+
+from config import PRIORITY_WEIGHTS, MAX_QUEUED_BROADCASTS
+from shared.framed_socket import FramedSocket
+
+
+class Priority(Enum):
+    """Outbound message priorities, most urgent first."""
+    Control = 0
+    Private = 1
+    Broadcast = 2
+
+
+class PrioritySender:
+    """Sends a connection's messages from a queue per priority.
+
+    A single thread writes every message, so frames are never interleaved.
+    Queues are served by weighted round robin: each round, a queue may send
+    up to its weight in messages, more urgent queues first. Urgent messages
+    skip past backlogs of less urgent ones, which still get their share.
+    Messages that must not overtake anything already queued, such as EXIT,
+    can be held back until every earlier message has been sent.
+    """
+
+    def __init__(
+            self,
+            conn: FramedSocket,
+            weights: tuple[int, ...] = PRIORITY_WEIGHTS,
+            on_disconnect: Callable[["PrioritySender"], None] = None,
+            max_broadcasts: int = MAX_QUEUED_BROADCASTS
+    ) -> None:
+        """Initialize the sender and start its sending thread.
+
+        Weights are given in the order of Priority. on_disconnect is called
+        with the sender if the connection is lost, including when it's
+        dropped for having more than max_broadcasts broadcasts queued.
+        """
+        self.conn = conn
+        self._weights = weights
+        self._on_disconnect = on_disconnect
+        self._max_broadcasts = max_broadcasts
+
+        # Messages waiting to be sent, one queue per priority, as
+        # (order queued, message, whether it waits for earlier messages)
+        self._queues = [deque() for _ in Priority]
+        self._queued_count = 0
+
+        # Messages each queue may still send this round
+        self._credits = list(weights)
+
+        # Guards the queues and signals when they change
+        self._changed = threading.Condition()
+
+        # Whether a message has been taken from a queue but not yet sent
+        self._sending = False
+
+        # Indicates that the sending thread should exit
+        self._stopping = False
+
+        # Indicates that the connection was lost
+        self._disconnected = False
+
+        self._send_thread = threading.Thread(target=self._send_forever)
+        self._send_thread.start()
+
+    def send_msg(
+            self, msg: str, priority: Priority, after_queued: bool = False
+    ) -> None:
+        """Queue a message to be sent.
+
+        If after_queued is True, the message isn't sent until every message
+        queued before it has been, whatever their priority. Messages are
+        dropped once the sender has stopped.
+        """
+        with self._changed:
+            if self._stopping:
+                return
+
+            queue = self._queues[priority.value]
+            if (
+                    priority is not Priority.Broadcast
+                    or len(queue) < self._max_broadcasts
+            ):
+                queue.append((self._queued_count, msg, after_queued))
+                self._queued_count += 1
+                self._changed.notify_all()
+                return
+
+        # A client this far behind is dropped rather than queued for
+        # without limit
+        self.conn.shutdown()
+        self._disconnect()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued message has been sent.
+
+        Returns False if the timeout ran out first.
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self._stopping or not self._busy(), timeout
+            )
+
+    def stop(self, timeout: float = None) -> None:
+        """Stop sending, leaving the connection open.
+
+        Messages still queued are dropped. If a message is still being sent
+        after timeout seconds, such as to a client that stopped reading, the
+        connection is shut down to interrupt it.
+        """
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+
+        if threading.current_thread() is not self._send_thread:
+            self._send_thread.join(timeout)
+            if self._send_thread.is_alive():
+                self.conn.shutdown()
+                self._send_thread.join()
+
+    def close(self) -> None:
+        """Stop sending and close the connection."""
+        self.stop()
+        self.conn.close()
+
+    def fileno(self) -> int:
+        """Return the connection's file descriptor."""
+        return self.conn.fileno()
+
+    def is_closed(self) -> bool:
+        """Check if the connection is closed."""
+        return self.conn.is_closed()
+
+    def _busy(self) -> bool:
+        """Check if any message is queued or being sent."""
+        return self._sending or any(self._queues)
+
+    def _next_msg(self) -> str | None:
+        """Wait for the next message to send, or None once stopping."""
+        with self._changed:
+            self._sending = False
+            self._changed.notify_all()
+
+            while not self._stopping and not any(self._queues):
+                self._changed.wait()
+            if self._stopping:
+                return None
+
+            # Start a new round once no queue with messages has credit left
+            for _ in range(2):
+                for priority, queue in enumerate(self._queues):
+                    if (
+                            queue
+                            and self._credits[priority]
+                            and not self._held_back(queue[0])
+                    ):
+                        self._credits[priority] -= 1
+                        self._sending = True
+                        return queue.popleft()[1]
+                self._credits = list(self._weights)
+
+    def _held_back(self, queued: tuple[int, str, bool]) -> bool:
+        """Check if a message must wait for earlier messages to be sent."""
+        order, _, after_queued = queued
+        return after_queued and any(
+            queue and queue[0][0] < order for queue in self._queues
+        )
+
+    def _send_forever(self) -> None:
+        """Send queued messages until stopped or disconnected."""
+        while (msg := self._next_msg()) is not None:
+            self.conn.send_msg(msg)
+
+            # Nothing more can be sent once the connection closes
+            if self.conn.is_closed():
+                self._disconnect()
+                return
+
+    def _disconnect(self) -> None:
+        """Drop queued messages and report that the connection was lost."""
+        with self._changed:
+            if self._disconnected:
+                return
+            self._disconnected = True
+            self._stopping = True
+            self._sending = False
+            for queue in self._queues:
+                queue.clear()
+            self._changed.notify_all()
+
+        if self._on_disconnect:
+            self._on_disconnect(self)
@@ -0,0 +1,234 @@
+"""Defines Profiler, which instruments the stages of handling a message."""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+# Before 3.12, cProfile only profiles the thread that enabled it. From 3.12 a
+# single enabled profiler covers every thread, and only one may be enabled.
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+
+# Used for stages while nothing is being measured
+_NO_STAGE = nullcontext()
+
+
+class Profiler:
+    """Measures the stages of handling a message while the program runs.
+
+    Stages are marked with stage(). Any of these can be switched on and off
+    at runtime:
+      - timing: a histogram of how long each stage takes, saved as JSON
+      - cProfile: a deterministic profile of the code run inside stages,
+        saved in pstats format
+      - sampling: stacks of every thread sampled periodically, saved as
+        collapsed stacks for flamegraph tools
+    """
+
+    class _Stage:
+        """Context manager measuring one run of a stage."""
+
+        __slots__ = ("_profiler", "_name", "_start")
+
+        def __init__(self, profiler: "Profiler", name: str) -> None:
+            """Initialize the stage."""
+            self._profiler = profiler
+            self._name = name
+
+        def __enter__(self) -> None:
+            """Start measuring the stage."""
+            self._profiler._enter_stage()
+            self._start = time.perf_counter_ns()
+
+        def __exit__(self, *exc_info) -> None:
+            """Stop measuring the stage."""
+            elapsed = time.perf_counter_ns() - self._start
+            self._profiler._exit_stage(self._name, elapsed)
+
+    def __init__(self) -> None:
+        """Initialize the profiler with everything switched off."""
+        # Whether anything is being measured, checked first by stage()
+        self._enabled = False
+
+        # Stage histograms, as {stage: {bucket: count}} where a bucket counts
+        # runs taking at most 2**bucket microseconds
+        self._timing = False
+        self._histograms: dict[str, Counter] = dict()
+        self._timing_lock = threading.Lock()
+
+        # Profiles of stages, one per thread before Python 3.12
+        self._cprofile = False
+        self._profiles: list[cProfile.Profile] = []
+        self._profiles_lock = threading.Lock()
+        self._thread_state = threading.local()
+
+        # Counts cProfile runs so threads know when to start a new profile
+        self._cprofile_run = 0
+
+        # Collapsed stacks and how many times each was sampled
+        self._samples: Counter = Counter()
+        self._sampler: threading.Thread | None = None
+        self._stop_sampling = threading.Event()
+
+    def stage(self, name: str):
+        """Get a context manager that measures a stage."""
+        if not self._enabled:
+            return _NO_STAGE
+        return self._Stage(self, name)
+
+    def start_timing(self) -> None:
+        """Start recording stage timing histograms."""
+        self._histograms = dict()
+        self._timing = True
+        self._update_enabled()
+
+    def stop_timing(self, path: str) -> bool:
+        """Stop recording stage timings and save the histograms as JSON.
+
+        Returns whether they were being recorded, and so saved.
+        """
+        if not self._timing:
+            return False
+
+        self._timing = False
+        self._update_enabled()
+
+        with self._timing_lock:
+            report = {
+                stage: {
+                    "count": sum(buckets.values()),
+                    "buckets_us": {
+                        f"<={2 ** bucket}": count
+                        for bucket, count in sorted(buckets.items())
+                    }
+                }
+                for stage, buckets in self._histograms.items()
+            }
+
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        return True
+
+    def start_cprofile(self) -> None:
+        """Start profiling stages with cProfile."""
+        if self._cprofile:
+            return
+
+        self._profiles = []
+        self._cprofile_run += 1
+        if not PER_THREAD_CPROFILE:
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+
+        self._cprofile = True
+        self._update_enabled()
+
+    def stop_cprofile(self, path: str) -> bool:
+        """Stop profiling and save the combined profile in pstats format.
+
+        Returns whether profiling was running, and so saved.
+        """
+        if not self._cprofile:
+            return False
+
+        self._cprofile = False
+        self._update_enabled()
+
+        if not PER_THREAD_CPROFILE:
+            self._profiles[0].disable()
+
+        with self._profiles_lock:
+            pstats.Stats(*self._profiles).dump_stats(path)
+        return True
+
+    def start_sampling(self, interval: float) -> None:
+        """Start sampling the stacks of all threads every interval seconds."""
+        if self._sampler:
+            return
+
+        self._samples = Counter()
+        self._stop_sampling.clear()
+        self._sampler = threading.Thread(
+            target=self._sample_forever, args=(interval,), daemon=True
+        )
+        self._sampler.start()
+
+    def stop_sampling(self, path: str) -> bool:
+        """Stop sampling and save the samples as collapsed stacks.
+
+        Returns whether sampling was running, and so saved.
+        """
+        if not self._sampler:
+            return False
+
+        self._stop_sampling.set()
+        self._sampler.join()
+        self._sampler = None
+
+        with open(path, "w") as file:
+            for stack, count in self._samples.most_common():
+                file.write(f"{stack} {count}\n")
+        return True
+
+    def _update_enabled(self) -> None:
+        """Check whether stages need to be measured."""
+        self._enabled = self._timing or self._cprofile
+
+    def _enter_stage(self) -> None:
+        """Start profiling the current thread if it isn't already."""
+        if not (self._cprofile and PER_THREAD_CPROFILE):
+            return
+
+        # Stages can be nested, but only the outermost one toggles profiling
+        depth = getattr(self._thread_state, "depth", 0)
+        self._thread_state.depth = depth + 1
+        if depth:
+            return
+
+        # Each thread needs its own profile for each run
+        if getattr(self._thread_state, "run", None) != self._cprofile_run:
+            self._thread_state.run = self._cprofile_run
+            self._thread_state.profile = cProfile.Profile()
+            with self._profiles_lock:
+                self._profiles.append(self._thread_state.profile)
+        self._thread_state.profile.enable()
+
+    def _exit_stage(self, name: str, elapsed_ns: int) -> None:
+        """Record a finished stage."""
+        if getattr(self._thread_state, "depth", 0):
+            self._thread_state.depth -= 1
+            if not self._thread_state.depth:
+                self._thread_state.profile.disable()
+
+        if self._timing:
+            elapsed_us = max(-(-elapsed_ns // 1000), 1)
+            bucket = (elapsed_us - 1).bit_length()
+            with self._timing_lock:
+                self._histograms.setdefault(name, Counter())[bucket] += 1
+
+    def _sample_forever(self, interval: float) -> None:
+        """Sample the stacks of all other threads until stopped."""
+        own_id = threading.get_ident()
+        while not self._stop_sampling.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                # Collapsed stacks list frames from the outermost call in
+                stack = []
+                while frame:
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    stack.append(f"{filename}:{code.co_name}")
+                    frame = frame.f_back
+                self._samples[";".join(reversed(stack))] += 1
+
+
+# Shared by everything in the process so stages can be toggled in one place
+PROFILER = Profiler()